@@ -1,13 +1,19 @@
-import os
 import asyncio
+import os
 
 import chainlit as cl
-from uuid import uuid4
+from chainlit.config import config
 from chainlit.logger import logger
+from chainlit.user_session import user_sessions
 from dotenv import load_dotenv
 
-from realtime import RealtimeClient
-from realtime.tools import tools
+from realtime import RealtimeClient, services
+from realtime.audio_output import AudioOutputQueue
+from realtime.connection import RealtimeConnectionManager
+from realtime.conversation_log import ConversationLog
+from realtime.image_uploads import describe_images
+from realtime.model_images import model_images
+from realtime.tools import tools, tool_timeouts
 from realtime.vision import VisionModel
 
 
@@ -20,17 +26,24 @@ async def setup_openai_vision():
 
 async def setup_openai_realtime():
     """Instantiate and configure the OpenAI Realtime Client"""
-    openai_realtime = RealtimeClient(api_key=os.getenv("OPENAI_API_KEY"))
-    cl.user_session.set("track_id", str(uuid4()))
-    
-    async def handle_conversation_updated(event):
+    openai_realtime = RealtimeClient(api_key=os.getenv("OPENAI_API_KEY"), retain_audio=False)
+
+    async def send_audio_chunk(audio: bytes, track: str):
+        await cl.context.emitter.send_audio_chunk(cl.OutputAudioChunk(mimeType="pcm16", data=audio, track=track))
+
+    async def send_audio_interrupt():
+        await cl.context.emitter.send_audio_interrupt()
+
+    audio_output = AudioOutputQueue(send_audio_chunk, send_audio_interrupt)
+    cl.user_session.set("audio_output", audio_output)
+
+    def handle_conversation_updated(event):
+        """Currently used to stream audio back to the client. Runs inline, so audio is queued in order."""
         delta = event.get("delta")
-        """Currently used to stream audio back to the client."""
         if delta:
             # Only one of the following will be populated for any given event
             if 'audio' in delta:
-                audio = delta['audio']  # Int16Array, audio added
-                await cl.context.emitter.send_audio_chunk(cl.OutputAudioChunk(mimeType="pcm16", data=audio, track=cl.user_session.get("track_id")))
+                audio_output.put(delta['audio'])  # Int16 PCM bytes, audio added
             if 'transcript' in delta:
                 transcript = delta['transcript']  # string, transcript added
                 pass
@@ -43,10 +56,9 @@ async def setup_openai_realtime():
         # print(item) # TODO
         pass
     
-    async def handle_conversation_interrupt(event):
+    def handle_conversation_interrupt(event):
         """Used to cancel the client previous audio playback."""
-        cl.user_session.set("track_id", str(uuid4()))
-        await cl.context.emitter.send_audio_interrupt()
+        audio_output.interrupt()
         
     async def handle_error(event):
         logger.error(event)
@@ -58,33 +70,60 @@ async def setup_openai_realtime():
     openai_realtime.on('error', handle_error)
 
     cl.user_session.set("openai_realtime", openai_realtime)
-    coros = [openai_realtime.add_tool(tool_def, tool_handler) for tool_def, tool_handler in tools]
-    await asyncio.gather(*coros)
+    await openai_realtime.add_tools(tools, timeouts=tool_timeouts)
+
+    # Connect in the background, so the session is ready by the time the user clicks the microphone,
+    # and give every new connection the conversation so far
+    realtime_connection = RealtimeConnectionManager(openai_realtime, conversation_log=ConversationLog())
+    cl.user_session.set("realtime_connection", realtime_connection)
+    realtime_connection.prewarm()
 
 
 @cl.on_chat_start
 async def start():
+    # Clients are created on first use; the first chat creates them all concurrently in the background
+    services.warmup()
     await cl.Message(
         content="Click the microphone to start chatting with me!",
         elements=[cl.Image(
             path="static/images/logo.jpg",
             display="inline",
             size="medium"
+        )],
+        actions=[cl.Action(
+            name="upload_model_image",
+            value="upload",
+            label="Upload a full-body photo for virtual try-ons"
         )]
     ).send()
     await setup_openai_realtime()
     await setup_openai_vision()
 
+@cl.action_callback("upload_model_image")
+async def upload_model_image(action: cl.Action):
+    """Ask the user for a full-body photo, used instead of the default model in their try-ons."""
+    files = await cl.AskFileMessage(
+        content="Upload a full-body photo of yourself to see products on you.",
+        accept=["image/jpeg", "image/png", "image/webp"],
+        max_size_mb=10
+    ).send()
+    if files:
+        await asyncio.to_thread(model_images.register, cl.user_session.get("id"), files[0].path)
+        await cl.Message(content="Got it! Your virtual try-ons will use this photo.").send()
+
 @cl.on_message
 async def on_message(message: cl.Message):
     openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")
-    if openai_realtime and openai_realtime.is_connected():
-        # TODO: Try image processing with message.elements
+    if cl.user_session.get("audio_active") and openai_realtime.is_connected():
         content = message.content
-        for element in message.elements:
-            if element.mime.startswith("image") or element.url.startswith("data:image") or element.url.startswith("http"):
-                vision_model: VisionModel = cl.user_session.get("vision_model")
-                description = await vision_model.generate_image_description(element.url or element.path)
+        images = [
+            element.url or element.path
+            for element in message.elements
+            if (element.mime or "").startswith("image") or (element.url or "").startswith(("data:image", "http"))
+        ]
+        if images:
+            vision_model: VisionModel = cl.user_session.get("vision_model")
+            for description in await describe_images(vision_model, images):
                 content += "\nImage:\n" + description
 
         await openai_realtime.send_user_message_content([{ "type": 'input_text', "text": content.strip() }])
@@ -94,11 +133,10 @@ async def on_message(message: cl.Message):
 @cl.on_audio_start
 async def on_audio_start():
     try:
-        openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")
-        await openai_realtime.connect()
-        logger.info("Connected to OpenAI realtime")
-        # TODO: might want to recreate items to restore context
-        # openai_realtime.create_conversation_item(item)
+        realtime_connection: RealtimeConnectionManager = cl.user_session.get("realtime_connection")
+        waited = await realtime_connection.ensure_connected()
+        cl.user_session.set("audio_active", True)
+        logger.info(f"Connected to OpenAI realtime (waited {waited * 1000:.0f}ms)")
         return True
     except Exception as e:
         await cl.ErrorMessage(content=f"Failed to connect to OpenAI realtime: {e}").send()
@@ -112,10 +150,46 @@ async def on_audio_chunk(chunk: cl.InputAudioChunk):
     else:
         logger.info("RealtimeClient is not connected")
 
+async def disconnect_realtime():
+    cl.user_session.set("audio_active", False)
+    realtime_connection: RealtimeConnectionManager = cl.user_session.get("realtime_connection")
+    if realtime_connection:
+        await realtime_connection.disconnect()
+    audio_output: AudioOutputQueue = cl.user_session.get("audio_output")
+    if audio_output:
+        logger.info(f"Audio output: {audio_output.summary()}")
+        await audio_output.close()
+
 @cl.on_audio_end
-@cl.on_chat_end
-@cl.on_stop
 async def on_end():
-    openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")
-    if openai_realtime and openai_realtime.is_connected():
-        await openai_realtime.disconnect()
+    """End the realtime session, and warm up the next one for when the microphone is clicked again."""
+    await disconnect_realtime()
+    realtime_connection: RealtimeConnectionManager = cl.user_session.get("realtime_connection")
+    if realtime_connection:
+        realtime_connection.prewarm()
+
+async def release_model_image_when_cleared(session_id: str):
+    """
+    Release the user's model image once Chainlit clears their session, which it keeps for session_timeout after a
+    disconnect so the user can reconnect to it.
+    """
+    await asyncio.sleep(config.project.session_timeout + 1)
+    if session_id not in user_sessions:
+        model_images.remove(session_id)
+
+@cl.on_stop
+async def on_stop():
+    """Stop the realtime session. The user's model image and try-ons are kept, as the chat goes on."""
+    await disconnect_realtime()
+
+@cl.on_chat_end
+async def on_chat_end():
+    """
+    Cancel speculative try-ons the user has moved on from, disconnect, and release their model image once their
+    session is cleared.
+    """
+    try_on_warmup = cl.user_session.get("try_on_warmup")
+    if try_on_warmup:
+        try_on_warmup.cancel()
+    asyncio.create_task(release_model_image_when_cleared(cl.user_session.get("id")))
+    await disconnect_realtime()
@@ -4,7 +4,9 @@ import asyncio
 import base64
 import inspect
 import json
+import logging
 import os
+import time
 import websockets
 from collections import defaultdict
 from datetime import datetime
@@ -14,6 +16,15 @@ import numpy as np
 from chainlit.logger import logger
 from chainlit.config import config
 
+from realtime.audio import AudioRingBuffer, PcmBuffer, ms_to_pcm16_offset
+from realtime import tracing
+from realtime.serialization import Serializer, get_serializer
+
+
+REALTIME_URL = os.getenv("REALTIME_URL", "wss://api.openai.com/v1/realtime")
+REALTIME_DISPATCH_PROFILE = os.getenv("REALTIME_DISPATCH_PROFILE", "").lower() in ("1", "true")
+REALTIME_SESSION_TIMEOUT_SECONDS = float(os.getenv("REALTIME_SESSION_TIMEOUT_SECONDS", 10))
+REALTIME_TOOL_TIMEOUT_SECONDS = float(os.getenv("REALTIME_TOOL_TIMEOUT_SECONDS", 60))
 
 SYSTEM_INSTRUCTIONS = cleandoc("""
 System settings:
@@ -77,45 +88,95 @@ def array_buffer_to_base64(array_buffer):
 
 class RealtimeEventHandler:
     def __init__(self):
-        self.event_handlers = defaultdict(list)
+        # Handlers are classified once here, and stored as tuples replaced on change so dispatch can iterate them
+        # while handlers add or remove themselves
+        self.event_handlers = {}
+        self._tasks = set()
+        self.dispatch_profile = defaultdict(lambda: [0, 0]) if REALTIME_DISPATCH_PROFILE else None
 
     def on(self, event_name, handler):
-        self.event_handlers[event_name].append(handler)
-        
+        entry = (handler, inspect.iscoroutinefunction(handler))
+        self.event_handlers[event_name] = self.event_handlers.get(event_name, ()) + (entry,)
+
+    def off(self, event_name, handler):
+        handlers = tuple(entry for entry in self.event_handlers.get(event_name, ()) if entry[0] != handler)
+        if handlers:
+            self.event_handlers[event_name] = handlers
+        else:
+            self.event_handlers.pop(event_name, None)
+
+    def has_handlers(self, event_name):
+        return event_name in self.event_handlers
+
     def clear_event_handlers(self):
-        self.event_handlers = defaultdict(list)
+        self.event_handlers = {}
 
     def dispatch(self, event_name, event):
-        for handler in self.event_handlers[event_name]:
-            if inspect.iscoroutinefunction(handler):
-                asyncio.create_task(handler(event))
+        handlers = self.event_handlers.get(event_name)
+        if not handlers:
+            return
+        if self.dispatch_profile is not None:
+            start = time.perf_counter_ns()
+        for handler, is_coroutine in handlers:
+            if is_coroutine:
+                task = asyncio.create_task(handler(event))
+                self._tasks.add(task)
+                task.add_done_callback(self._on_task_done)
             else:
                 handler(event)
-
-    async def wait_for_next(self, event_name):
-        future = asyncio.Future()
+        if self.dispatch_profile is not None:
+            stats = self.dispatch_profile[event_name]
+            stats[0] += 1
+            stats[1] += time.perf_counter_ns() - start
+
+    def _on_task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Realtime event handler failed", exc_info=task.exception())
+
+    def format_dispatch_profile(self):
+        """
+        Summarize the dispatch cost per event, most expensive first. Async handlers are counted up to their task
+        being created, and nested dispatches are included in the time of the dispatch that triggered them.
+        """
+        lines = [f"{'event':<60}{'count':>10}{'total ms':>12}{'mean us':>10}"]
+        for event_name, (count, total_ns) in sorted(self.dispatch_profile.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{event_name:<60}{count:>10}{total_ns / 1e6:>12.2f}{total_ns / count / 1e3:>10.2f}")
+        return "\n".join(lines)
+
+    async def wait_for_next(self, event_name, timeout=None):
+        """
+        Wait for the next event, subscribing only until it arrives, the timeout expires or the wait is cancelled.
+        """
+        future = asyncio.get_running_loop().create_future()
 
         def handler(event):
             if not future.done():
                 future.set_result(event)
 
         self.on(event_name, handler)
-        return await future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.off(event_name, handler)
 
 
 class RealtimeAPI(RealtimeEventHandler):
-    def __init__(self, url=None, api_key=None):
+    def __init__(self, url=None, api_key=None, serializer: Serializer = None):
         super().__init__()
-        self.default_url = 'wss://api.openai.com/v1/realtime'
+        self.default_url = REALTIME_URL
         self.url = url or self.default_url
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.serializer = serializer or get_serializer()
         self.ws = None
 
     def is_connected(self):
         return self.ws is not None
 
     def log(self, *args):
-        logger.debug(f"[Websocket/{datetime.utcnow().isoformat()}]", *args)
+        # Events can carry large audio payloads, so only format them if debug logging is enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[Websocket/{datetime.utcnow().isoformat()}] " + " ".join(str(arg) for arg in args))
 
     async def connect(self, model='gpt-4o-realtime-preview-2024-10-01'):
         if self.is_connected():
@@ -128,13 +189,26 @@ class RealtimeAPI(RealtimeEventHandler):
         asyncio.create_task(self._receive_messages())
 
     async def _receive_messages(self):
-        async for message in self.ws:
-            event = json.loads(message)
-            if event['type'] == "error":
-                logger.error("ERROR", event)
-            self.log("received:", event)
-            self.dispatch(f"server.{event['type']}", event)
-            self.dispatch("server.*", event)
+        ws = self.ws
+        try:
+            async for message in ws:
+                self._handle_message(message)
+        except websockets.ConnectionClosedError as e:
+            logger.warning(f"Realtime connection lost: {e}")
+        finally:
+            # Only a connection that was not closed by disconnect() is reported
+            if self.ws is ws:
+                self.ws = None
+                self.log(f"Connection to {self.url} closed")
+                self.dispatch("close", {"code": ws.close_code, "reason": ws.close_reason})
+
+    def _handle_message(self, message):
+        event = self.serializer.loads(message)
+        if event['type'] == "error":
+            logger.error(f"Realtime API error: {event}")
+        self.log("received:", event)
+        self.dispatch(f"server.{event['type']}", event)
+        self.dispatch("server.*", event)
 
     async def send(self, event_name, data=None):
         if not self.is_connected():
@@ -150,15 +224,16 @@ class RealtimeAPI(RealtimeEventHandler):
         self.dispatch(f"client.{event_name}", event)
         self.dispatch("client.*", event)
         self.log("sent:", event)
-        await self.ws.send(json.dumps(event))
+        await self.ws.send(self.serializer.dumps(event))
 
     def _generate_id(self, prefix):
         return f"{prefix}{int(datetime.utcnow().timestamp() * 1000)}"
 
     async def disconnect(self):
-        if self.ws:
-            await self.ws.close()
-            self.ws = None
+        # Cleared first, so the receive loop does not report a deliberate close while it is awaited
+        ws, self.ws = self.ws, None
+        if ws:
+            await ws.close()
             self.log(f"Disconnected from {self.url}")
 
 class RealtimeConversation:
@@ -181,7 +256,10 @@ class RealtimeConversation:
         'response.function_call_arguments.delta': lambda self, event: self._process_function_call_arguments_delta(event),
     }
     
-    def __init__(self):
+    def __init__(self, retain_audio=True):
+        # Unless audio is retained, the user's speech is not copied into its items and assistant audio is dropped
+        # once its item is done
+        self.retain_audio = retain_audio
         self.clear()
 
     def clear(self):
@@ -215,13 +293,14 @@ class RealtimeConversation:
             self.item_lookup[new_item['id']] = new_item
             self.items.append(new_item)
         new_item['formatted'] = {
-            'audio': [],
+            'audio': PcmBuffer(),
             'text': '',
             'transcript': ''
         }
         if new_item['id'] in self.queued_speech_items:
-            new_item['formatted']['audio'] = self.queued_speech_items[new_item['id']]['audio']
-            del self.queued_speech_items[new_item['id']]
+            speech = self.queued_speech_items.pop(new_item['id'])
+            if 'audio' in speech:
+                new_item['formatted']['audio'] = speech['audio']
         if 'content' in new_item:
             text_content = [c for c in new_item['content'] if c['type'] in ['text', 'input_text']]
             for content in text_content:
@@ -258,7 +337,7 @@ class RealtimeConversation:
             raise Exception(f'item.truncated: Item "{item_id}" not found')
         end_index = (audio_end_ms * self.default_frequency) // 1000
         item['formatted']['transcript'] = ''
-        item['formatted']['audio'] = item['formatted']['audio'][:end_index]
+        item['formatted']['audio'].truncate(end_index)
         return item, None
 
     def _process_item_deleted(self, event):
@@ -294,10 +373,11 @@ class RealtimeConversation:
         audio_end_ms = event['audio_end_ms']
         speech = self.queued_speech_items[item_id]
         speech['audio_end_ms'] = audio_end_ms
-        if input_audio_buffer:
-            start_index = (speech['audio_start_ms'] * self.default_frequency) // 1000
-            end_index = (speech['audio_end_ms'] * self.default_frequency) // 1000
-            speech['audio'] = input_audio_buffer[start_index:end_index]
+        if input_audio_buffer and self.retain_audio:
+            start_index = ms_to_pcm16_offset(speech['audio_start_ms'], self.default_frequency)
+            end_index = ms_to_pcm16_offset(speech['audio_end_ms'], self.default_frequency)
+            # Copied, since the item keeps its audio for the whole conversation and the ring wraps around
+            speech['audio'] = bytes(input_audio_buffer.slice(start_index, end_index))
         return None, None
 
     def _process_response_created(self, event):
@@ -324,6 +404,8 @@ class RealtimeConversation:
         if not found_item:
             raise Exception(f'response.output_item.done: Item "{item["id"]}" not found')
         found_item['status'] = item['status']
+        if not self.retain_audio and isinstance(found_item['formatted']['audio'], PcmBuffer):
+            found_item['formatted']['audio'].release()
         return found_item, None
 
     def _process_content_part_added(self, event):
@@ -354,9 +436,8 @@ class RealtimeConversation:
         if not item:
             logger.debug(f'response.audio.delta: Item "{item_id}" not found')
             return None, None
-        array_buffer = base64_to_array_buffer(delta)
-        append_values = array_buffer.tobytes()
-        item['formatted']['audio'] += [append_values]
+        append_values = base64.b64decode(delta)
+        item['formatted']['audio'].append(append_values)
         return item, {'audio': append_values}
 
     def _process_text_delta(self, event):
@@ -382,8 +463,10 @@ class RealtimeConversation:
 
 
 class RealtimeClient(RealtimeEventHandler):
-    def __init__(self, url=None, api_key=None):
+    def __init__(self, url=None, api_key=None, input_audio_window_ms=30_000, retain_audio=True):
         super().__init__()
+        # Input audio is only retained for as long as a speech segment detected by the server VAD can last
+        self.input_audio_window_ms = input_audio_window_ms
         self.default_session_config = {
             "modalities": ["text", "audio"],
             "instructions": SYSTEM_INSTRUCTIONS,
@@ -406,20 +489,30 @@ class RealtimeClient(RealtimeEventHandler):
             "silence_duration_ms": 300,
         }
         self.realtime = RealtimeAPI(url, api_key)
-        self.conversation = RealtimeConversation()
+        self.conversation = RealtimeConversation(retain_audio=retain_audio)
         self._reset_config()
         self._add_api_event_handlers()
         
+    @property
+    def session_created(self):
+        return self._session_created.is_set()
+
     def _reset_config(self):
-        self.session_created = False
+        self._session_created = asyncio.Event()
         self.tools = {}
+        # Tool calls in progress by response id, as (tool, task) pairs
+        self.tool_calls = {}
+        self.turn_span = None
         self.session_config = self.default_session_config.copy()
-        self.input_audio_buffer = bytearray()
+        self.input_audio_buffer = AudioRingBuffer(
+            ms_to_pcm16_offset(self.input_audio_window_ms, RealtimeConversation.default_frequency)
+        )
+        self.input_audio_committed = 0
         return True
 
     def _add_api_event_handlers(self):
-        self.realtime.on("client.*", self._log_event)
-        self.realtime.on("server.*", self._log_event)
+        self.realtime.on("client.*", lambda event: self._log_event("client", event))
+        self.realtime.on("server.*", lambda event: self._log_event("server", event))
         self.realtime.on("server.session.created", self._on_session_created)
         self.realtime.on("server.response.created", self._process_event)
         self.realtime.on("server.response.output_item.added", self._process_event)
@@ -435,17 +528,31 @@ class RealtimeClient(RealtimeEventHandler):
         self.realtime.on("server.response.text.delta", self._process_event)
         self.realtime.on("server.response.function_call_arguments.delta", self._process_event)
         self.realtime.on("server.response.output_item.done", self._on_output_item_done)
-
-    def _log_event(self, event):
+        self.realtime.on("server.response.done", self._on_response_done)
+        self.realtime.on("close", self._on_connection_closed)
+        if tracing.is_enabled():
+            self.realtime.on("server.response.audio.delta", self._on_turn_audio)
+
+    def _log_event(self, source, event):
+        if not self.has_handlers("realtime.event"):
+            return
         realtime_event = {
             "time": datetime.utcnow().isoformat(),
-            "source": "client" if event["type"].startswith("client.") else "server",
+            "source": source,
             "event": event,
         }
         self.dispatch("realtime.event", realtime_event)
 
     def _on_session_created(self, event):
-        self.session_created = True
+        self._session_created.set()
+
+    def _on_connection_closed(self, event):
+        self._session_created.clear()
+        # Outputs can not be sent to the session a reconnect creates, which does not know their calls
+        self.cancel_tool_calls()
+        self.tool_calls = {}
+        self._end_turn()
+        self.dispatch("connection.closed", event)
 
     def _process_event(self, event, *args):
         item, delta = self.conversation.process_event(event, *args)
@@ -455,10 +562,31 @@ class RealtimeClient(RealtimeEventHandler):
 
     def _on_speech_started(self, event):
         self._process_event(event)
+        self.cancel_tool_calls()
         self.dispatch("conversation.interrupted", event)
 
     def _on_speech_stopped(self, event):
         self._process_event(event, self.input_audio_buffer)
+        self._start_turn("audio")
+
+    def _start_turn(self, input_type):
+        """
+        Trace the user's turn until the response that does not call tools is done. For voice turns this is called
+        from the receive loop, so the tool calls it starts are traced as part of the turn.
+        """
+        self._end_turn()
+        tracing.set_current(None)
+        self.turn_span = tracing.start_span("realtime.turn", input=input_type)
+        tracing.set_current(self.turn_span)
+
+    def _end_turn(self):
+        if self.turn_span:
+            self.turn_span.end()
+            self.turn_span = None
+
+    def _on_turn_audio(self, event):
+        if self.turn_span and "first_audio_ms" not in self.turn_span.attributes:
+            self.turn_span.set(first_audio_ms=self.turn_span.elapsed_ms())
 
     def _on_item_created(self, event):
         item, delta = self._process_event(event)
@@ -466,37 +594,61 @@ class RealtimeClient(RealtimeEventHandler):
         if item and item["status"] == "completed":
             self.dispatch("conversation.item.completed", {"item": item})
 
-    async def _on_output_item_done(self, event):
+    def _on_output_item_done(self, event):
         item, delta = self._process_event(event)
         if item and item["status"] == "completed":
             self.dispatch("conversation.item.completed", {"item": item})
         if item and item.get("formatted", {}).get("tool"):
-            await self._call_tool(item["formatted"]["tool"])
+            # Tools start as soon as their call is complete, concurrently with the rest of the response
+            tool = item["formatted"]["tool"]
+            task = asyncio.create_task(self._call_tool(tool))
+            self.tool_calls.setdefault(event["response_id"], []).append((tool, task))
+
+    async def _on_response_done(self, event):
+        calls = self.tool_calls.get(event["response"]["id"])
+        if not calls:
+            self._end_turn()
+            return
+        results = await asyncio.gather(*(task for _, task in calls), return_exceptions=True)
+        if self.tool_calls.pop(event["response"]["id"], None) is not calls:
+            # Dropped with the connection they were made on
+            return
+        interrupted = False
+        outputs = []
+        for (tool, _), result in zip(calls, results):
+            if isinstance(result, asyncio.CancelledError):
+                interrupted = True
+                result = {"error": "Cancelled because the user interrupted"}
+            outputs.append({"type": "function_call_output", "call_id": tool["call_id"], "output": json.dumps(result)})
+        if not self.is_connected():
+            return
+        await self.create_conversation_items(outputs)
+        # The user is speaking after an interruption, and their turn will create the next response
+        if not interrupted:
+            await self.create_response()
 
     async def _call_tool(self, tool):
+        tool_config = self.tools.get(tool["name"])
         try:
-            json_arguments = json.loads(tool["arguments"])
-            tool_config = self.tools.get(tool["name"])
             if not tool_config:
                 raise Exception(f'Tool "{tool["name"]}" has not been added')
-            result = await tool_config["handler"](**json_arguments)
-            await self.realtime.send("conversation.item.create", {
-                "item": {
-                    "type": "function_call_output",
-                    "call_id": tool["call_id"],
-                    "output": json.dumps(result),
-                }
-            })
+            json_arguments = json.loads(tool["arguments"])
+            with tracing.span(f"tool.{tool['name']}"):
+                return await asyncio.wait_for(tool_config["handler"](**json_arguments), tool_config["timeout"])
+        except asyncio.TimeoutError:
+            logger.error(f'Tool "{tool["name"]}" timed out after {tool_config["timeout"]}s')
+            return {"error": f"Timed out after {tool_config['timeout']}s"}
         except Exception as e:
             logger.error(f"Tool call error: {json.dumps({'error': str(e)})}")
-            await self.realtime.send("conversation.item.create", {
-                "item": {
-                    "type": "function_call_output",
-                    "call_id": tool["call_id"],
-                    "output": json.dumps({"error": str(e)}),
-                }
-            })
-        await self.create_response()
+            return {"error": str(e)}
+
+    def cancel_tool_calls(self):
+        """
+        Cancel the tool calls in progress. Their outputs report the cancellation once their response is done.
+        """
+        for calls in self.tool_calls.values():
+            for _, task in calls:
+                task.cancel()
 
     def is_connected(self):
         return self.realtime.is_connected()
@@ -512,26 +664,37 @@ class RealtimeClient(RealtimeEventHandler):
         if self.is_connected():
             raise Exception("Already connected, use .disconnect() first")
         await self.realtime.connect()
+        # Server audio offsets restart with every session
+        self.input_audio_buffer.clear()
+        self.input_audio_committed = 0
         await self.update_session()
         return True
 
-    async def wait_for_session_created(self):
+    async def wait_for_session_created(self, timeout=REALTIME_SESSION_TIMEOUT_SECONDS):
         if not self.is_connected():
             raise Exception("Not connected, use .connect() first")
-        while not self.session_created:
-            await asyncio.sleep(0.001)
+        await asyncio.wait_for(self._session_created.wait(), timeout)
         return True
 
     async def disconnect(self):
-        self.session_created = False
+        if REALTIME_DISPATCH_PROFILE:
+            logger.info(
+                "Realtime dispatch profile:\n"
+                f"{self.realtime.format_dispatch_profile()}\n{self.format_dispatch_profile()}"
+            )
+        self._session_created.clear()
         self.conversation.clear()
+        # Outputs can not be sent to a new session
+        self.cancel_tool_calls()
+        self.tool_calls = {}
+        self._end_turn()
         if self.realtime.is_connected():
             await self.realtime.disconnect()
 
     def get_turn_detection_type(self):
         return self.session_config.get("turn_detection", {}).get("type")
 
-    async def add_tool(self, definition, handler):
+    async def add_tool(self, definition, handler, timeout=REALTIME_TOOL_TIMEOUT_SECONDS):
         if not definition.get("name"):
             raise Exception("Missing tool name in definition")
         name = definition["name"]
@@ -539,10 +702,35 @@ class RealtimeClient(RealtimeEventHandler):
             raise Exception(f'Tool "{name}" already added. Please use .removeTool("{name}") before trying to add again.')
         if not callable(handler):
             raise Exception(f'Tool "{name}" handler must be a function')
-        self.tools[name] = {"definition": definition, "handler": handler}
+        self.tools[name] = {"definition": definition, "handler": handler, "timeout": timeout}
         await self.update_session()
         return self.tools[name]
 
+    async def add_tools(self, tools, timeouts=None):
+        """
+        Add several (definition, handler) tools, updating the session once for all of them.
+
+        Args:
+            tools: (definition, handler) pairs
+            timeouts: Timeouts in seconds by tool name, for tools that should not use the default timeout
+        """
+        timeouts = timeouts or {}
+        for definition, handler in tools:
+            if not definition.get("name"):
+                raise Exception("Missing tool name in definition")
+            if definition["name"] in self.tools:
+                raise Exception(f'Tool "{definition["name"]}" already added.')
+            if not callable(handler):
+                raise Exception(f'Tool "{definition["name"]}" handler must be a function')
+        for definition, handler in tools:
+            self.tools[definition["name"]] = {
+                "definition": definition,
+                "handler": handler,
+                "timeout": timeouts.get(definition["name"], REALTIME_TOOL_TIMEOUT_SECONDS),
+            }
+        await self.update_session()
+        return True
+
     def remove_tool(self, name):
         if name not in self.tools:
             raise Exception(f'Tool "{name}" does not exist, can not be removed.')
@@ -572,7 +760,15 @@ class RealtimeClient(RealtimeEventHandler):
             "item": item
         })
 
+    async def create_conversation_items(self, items):
+        """
+        Append several items to the conversation, sent back to back without waiting for the server in between.
+        """
+        for item in items:
+            await self.realtime.send("conversation.item.create", {"item": item})
+
     async def send_user_message_content(self, content=[]):
+        self._start_turn("text")
         if content:
             for c in content:
                 if c["type"] == "input_audio":
@@ -590,17 +786,22 @@ class RealtimeClient(RealtimeEventHandler):
 
     async def append_input_audio(self, array_buffer):
         if len(array_buffer) > 0:
+            audio = memoryview(array_buffer)
             await self.realtime.send("input_audio_buffer.append", {
-                "audio": array_buffer_to_base64(np.array(array_buffer)),
+                "audio": base64.b64encode(audio).decode('ascii'),
             })
-            self.input_audio_buffer.extend(array_buffer)
+            self.input_audio_buffer.append(audio)
         return True
 
     async def create_response(self):
-        if self.get_turn_detection_type() is None and len(self.input_audio_buffer) > 0:
+        if self.get_turn_detection_type() is None and self.input_audio_buffer.end > self.input_audio_committed:
             await self.realtime.send("input_audio_buffer.commit")
-            self.conversation.queue_input_audio(self.input_audio_buffer)
-            self.input_audio_buffer = bytearray()
+            if self.conversation.retain_audio:
+                # Copied, since the queued audio outlives the ring window
+                self.conversation.queue_input_audio(
+                    bytes(self.input_audio_buffer.slice(self.input_audio_committed, self.input_audio_buffer.end))
+                )
+            self.input_audio_committed = self.input_audio_buffer.end
         await self.realtime.send("response.create")
         return True
 
@@ -627,10 +828,10 @@ class RealtimeClient(RealtimeEventHandler):
             })
             return {"item": item}
 
-    async def wait_for_next_item(self):
-        event = await self.wait_for_next("conversation.item.appended")
+    async def wait_for_next_item(self, timeout=None):
+        event = await self.wait_for_next("conversation.item.appended", timeout)
         return {"item": event["item"]}
 
-    async def wait_for_next_completed_item(self):
-        event = await self.wait_for_next("conversation.item.completed")
+    async def wait_for_next_completed_item(self, timeout=None):
+        event = await self.wait_for_next("conversation.item.completed", timeout)
         return {"item": event["item"]}
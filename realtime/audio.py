@@ -0,0 +1,103 @@
+import numpy as np
+
+
+PCM16_SAMPLE_WIDTH = 2
+
+
+def ms_to_pcm16_offset(ms: int, sample_rate: int) -> int:
+    """
+    Convert a time in milliseconds to a byte offset in mono PCM16 audio.
+    """
+    return (ms * sample_rate // 1000) * PCM16_SAMPLE_WIDTH
+
+
+class AudioRingBuffer:
+    def __init__(self, capacity: int):
+        """
+        Bounded buffer of the most recent audio, addressed by absolute byte offsets since the buffer was cleared.
+
+        Every byte is written twice, at its position in the ring and one capacity further, so any window of the
+        retained audio is contiguous and can be sliced as a memoryview without copying.
+
+        Args:
+            capacity: Number of most recent bytes retained
+        """
+        self.capacity = capacity
+        self._buffer = bytearray(2 * capacity)
+        self._view = memoryview(self._buffer)
+        self.end = 0
+
+    @property
+    def start(self) -> int:
+        """Absolute offset of the oldest retained byte."""
+        return max(0, self.end - self.capacity)
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def clear(self) -> None:
+        self.end = 0
+
+    def append(self, data) -> None:
+        data = memoryview(data).cast("B")
+        if len(data) > self.capacity:
+            self.end += len(data) - self.capacity
+            data = data[-self.capacity:]
+        position = self.end % self.capacity
+        head = min(len(data), self.capacity - position)
+        for offset in (0, self.capacity):
+            self._view[offset + position:offset + position + head] = data[:head]
+            self._view[offset:offset + len(data) - head] = data[head:]
+        self.end += len(data)
+
+    def slice(self, start: int, end: int) -> memoryview:
+        """
+        Get a view of the audio between two absolute byte offsets, clipped to the retained audio.
+        The view is not a copy: it is overwritten once the ring wraps around past it.
+        """
+        start, end = max(start, self.start), min(end, self.end)
+        if start >= end:
+            return self._view[0:0]
+        position = start % self.capacity
+        return self._view[position:position + end - start]
+
+
+class PcmBuffer:
+    def __init__(self, initial_samples: int = 0):
+        """
+        Growable buffer of PCM16 samples, preallocated and grown geometrically so appends are amortized copies
+        into one contiguous array instead of a list of chunks.
+
+        Args:
+            initial_samples: Number of samples to preallocate
+        """
+        self._samples = np.empty(initial_samples, dtype=np.int16)
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def append(self, data: bytes) -> None:
+        samples = np.frombuffer(data, dtype=np.int16)
+        end = self.length + len(samples)
+        if end > len(self._samples):
+            grown = np.empty(max(end, 2 * len(self._samples), 4096), dtype=np.int16)
+            grown[:self.length] = self._samples[:self.length]
+            self._samples = grown
+        self._samples[self.length:end] = samples
+        self.length = end
+
+    def truncate(self, num_samples: int) -> None:
+        self.length = max(0, min(self.length, num_samples))
+
+    def release(self) -> None:
+        """Drop the retained samples and their storage."""
+        self._samples = np.empty(0, dtype=np.int16)
+        self.length = 0
+
+    def samples(self) -> np.ndarray:
+        """View of the retained samples."""
+        return self._samples[:self.length]
+
+    def tobytes(self) -> bytes:
+        return self.samples().tobytes()
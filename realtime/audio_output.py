@@ -0,0 +1,161 @@
+import asyncio
+import os
+from collections import deque
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from chainlit.config import config
+from chainlit.logger import logger
+
+from realtime.audio import ms_to_pcm16_offset
+
+
+AUDIO_OUTPUT_FRAME_MS = int(os.getenv("AUDIO_OUTPUT_FRAME_MS", 100))
+AUDIO_OUTPUT_MAX_BUFFERED_MS = int(os.getenv("AUDIO_OUTPUT_MAX_BUFFERED_MS", 60_000))
+
+_INTERRUPT = object()
+
+
+class AudioOutputQueue:
+    def __init__(
+        self,
+        send_chunk: Callable[[bytes, str], Awaitable[None]],
+        send_interrupt: Callable[[], Awaitable[None]],
+        sample_rate: int = config.features.audio.sample_rate,
+        frame_ms: int = AUDIO_OUTPUT_FRAME_MS,
+        max_buffered_ms: int = AUDIO_OUTPUT_MAX_BUFFERED_MS,
+    ):
+        """
+        Per-session queue of PCM16 audio on its way to the browser, drained in order by a single consumer task.
+
+        Small deltas are coalesced into frames of frame_ms; a partial frame is sent once no more audio has arrived
+        for a frame's duration. An interrupt drops all waiting audio and starts a new track.
+
+        The queue is bounded by dropping the oldest audio rather than by backpressure: audio is queued by the
+        realtime client's receive loop, which must keep reading the interrupts and tool calls that follow it. When
+        more than max_buffered_ms of audio is waiting, the oldest frames are dropped, counted in stats and logged.
+
+        Args:
+            send_chunk: Coroutine sending a frame of audio and its track id to the browser
+            send_interrupt: Coroutine stopping the browser's playback of the current track
+            sample_rate: Sample rate of the audio
+            frame_ms: Duration of the frames sent to the browser
+            max_buffered_ms: Maximum duration of audio waiting to be sent
+        """
+        self.send_chunk = send_chunk
+        self.send_interrupt = send_interrupt
+        self.frame_bytes = ms_to_pcm16_offset(frame_ms, sample_rate)
+        self.frame_seconds = frame_ms / 1000
+        self.max_buffered_bytes = ms_to_pcm16_offset(max_buffered_ms, sample_rate)
+        self.bytes_per_ms = ms_to_pcm16_offset(1000, sample_rate) / 1000
+        self.track = str(uuid4())
+        self._pending = bytearray()
+        self._frames = deque()
+        self._buffered_bytes = 0
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "frames_sent": 0,
+            "bytes_sent": 0,
+            "frames_dropped": 0,
+            "bytes_dropped": 0,
+            "interrupts": 0,
+            "max_buffered_bytes": 0,
+        }
+        self._dropped_track = None
+
+    def depth_ms(self) -> float:
+        """Duration of the audio waiting to be sent."""
+        return (self._buffered_bytes + len(self._pending)) / self.bytes_per_ms
+
+    def summary(self) -> dict:
+        """Stats of the queue, with the current and maximum queue depth and the audio dropped in ms."""
+        return {
+            **self.stats,
+            "depth_ms": round(self.depth_ms()),
+            "max_depth_ms": round(self.stats["max_buffered_bytes"] / self.bytes_per_ms),
+            "dropped_ms": round(self.stats["bytes_dropped"] / self.bytes_per_ms),
+        }
+
+    def put(self, data: bytes) -> None:
+        """
+        Queue audio for the current track. Not a coroutine, so deltas are queued in the order they are dispatched.
+        """
+        self._pending += data
+        if len(self._pending) >= self.frame_bytes:
+            whole = len(self._pending) - len(self._pending) % self.frame_bytes
+            for start in range(0, whole, self.frame_bytes):
+                self._push(bytes(self._pending[start:start + self.frame_bytes]))
+            del self._pending[:whole]
+        self._wake()
+
+    def interrupt(self) -> None:
+        """
+        Drop the audio waiting to be sent, and stop the browser's playback before any audio queued after this call.
+        """
+        self._pending.clear()
+        self._frames.clear()
+        self._buffered_bytes = 0
+        self._frames.append((_INTERRUPT, None))
+        self.track = str(uuid4())
+        self.stats["interrupts"] += 1
+        self._wake()
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._pending.clear()
+        self._frames.clear()
+        self._buffered_bytes = 0
+
+    def _push(self, frame: bytes) -> None:
+        self._frames.append((self.track, frame))
+        self._buffered_bytes += len(frame)
+        dropped = 0
+        while self._buffered_bytes > self.max_buffered_bytes:
+            # A pending interrupt is always first, and must still be sent
+            index = 1 if self._frames[0][0] is _INTERRUPT else 0
+            oldest = self._frames[index][1]
+            del self._frames[index]
+            self._buffered_bytes -= len(oldest)
+            dropped += len(oldest)
+            self.stats["frames_dropped"] += 1
+        if dropped:
+            self.stats["bytes_dropped"] += dropped
+            # Once per track, since audio keeps being dropped until the browser catches up
+            if self._dropped_track != self.track:
+                self._dropped_track = self.track
+                logger.warning(
+                    f"Audio output is falling behind with {self._buffered_bytes / self.bytes_per_ms:.0f}ms queued, "
+                    "dropping the oldest audio"
+                )
+        self.stats["max_buffered_bytes"] = max(self.stats["max_buffered_bytes"], self._buffered_bytes)
+
+    def _wake(self) -> None:
+        self._ready.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            if not self._frames:
+                self._ready.clear()
+                try:
+                    await asyncio.wait_for(self._ready.wait(), self.frame_seconds if self._pending else None)
+                except asyncio.TimeoutError:
+                    self._push(bytes(self._pending))
+                    self._pending.clear()
+                continue
+
+            track, frame = self._frames.popleft()
+            try:
+                if track is _INTERRUPT:
+                    await self.send_interrupt()
+                    continue
+                self._buffered_bytes -= len(frame)
+                await self.send_chunk(frame, track)
+                self.stats["frames_sent"] += 1
+                self.stats["bytes_sent"] += len(frame)
+            except Exception as e:
+                logger.error(f"Failed to send audio to the browser: {e}")
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from chainlit.logger import logger
+
+from realtime import RealtimeClient
+from realtime.conversation_log import ConversationLog
+
+
+REALTIME_CONNECT_MAX_RETRIES = int(os.getenv("REALTIME_CONNECT_MAX_RETRIES", 5))
+REALTIME_CONNECT_BACKOFF_SECONDS = float(os.getenv("REALTIME_CONNECT_BACKOFF_SECONDS", 0.5))
+REALTIME_CONNECT_MAX_BACKOFF_SECONDS = 30.0
+# A warmed connection the microphone has not used for this long is closed, since realtime sessions are billed
+REALTIME_IDLE_DISCONNECT_SECONDS = float(os.getenv("REALTIME_IDLE_DISCONNECT_SECONDS", 120))
+REALTIME_MAX_RECONNECTS = int(os.getenv("REALTIME_MAX_RECONNECTS", 3))
+
+
+class RealtimeConnectionManager:
+    def __init__(
+        self,
+        client: RealtimeClient,
+        conversation_log: Optional[ConversationLog] = None,
+        max_retries: int = REALTIME_CONNECT_MAX_RETRIES,
+        backoff_seconds: float = REALTIME_CONNECT_BACKOFF_SECONDS,
+        idle_seconds: float = REALTIME_IDLE_DISCONNECT_SECONDS,
+        max_reconnects: int = REALTIME_MAX_RECONNECTS,
+    ):
+        """
+        Keeps a session's realtime client connected ahead of time, so the user can speak as soon as they click the
+        microphone. Connecting opens the websocket, sends the instructions and tools in a single session.update and
+        waits for the session to be created, retrying with exponential backoff. With a conversation log, each new
+        connection is given the text of the previous ones.
+
+        A warmed connection is closed if audio does not start within idle_seconds, so chats that never use the
+        microphone do not hold a realtime session. Connections lost while audio is active, or while a warmed
+        connection is waiting for it, are re-established in the background, at most max_reconnects times in a row.
+
+        Connections are warmed per session rather than pooled across sessions, since the receive loop has to run in
+        the Chainlit context of the session whose handlers it dispatches to.
+
+        Args:
+            client: Realtime client with its tools added
+            conversation_log: Log the conversation is captured into on disconnect and replayed from on connect
+            max_retries: Number of times a failed connection is retried
+            backoff_seconds: Delay before the first retry, doubled for each following retry
+            idle_seconds: Time after which a warmed connection audio has not started on is closed, never if 0
+            max_reconnects: Number of times a lost connection is re-established before giving up, until the next
+                prewarm or audio start
+        """
+        self.client = client
+        self.conversation_log = conversation_log
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.idle_seconds = idle_seconds
+        self.max_reconnects = max_reconnects
+        self.closed = False
+        self.audio_active = False
+        self._reconnects_left = max_reconnects
+        self._task: Optional[asyncio.Task] = None
+        self._idle_timer: Optional[asyncio.TimerHandle] = None
+        self._idle_task: Optional[asyncio.Task] = None
+        self.stats = {"connects": 0, "retries": 0, "failures": 0, "reconnects": 0, "idle_disconnects": 0}
+        client.on("connection.closed", self._on_connection_closed)
+
+    def is_ready(self) -> bool:
+        return self.client.is_connected() and self.client.session_created
+
+    def prewarm(self) -> asyncio.Task:
+        """
+        Start connecting in the background, unless connected or connecting already. Unless audio starts, the
+        connection is closed after idle_seconds.
+        """
+        self._reconnects_left = self.max_reconnects
+        if not self.audio_active:
+            self._schedule_idle_disconnect()
+        return self._connect()
+
+    async def ensure_connected(self) -> float:
+        """
+        Wait for the connection to be ready as audio starts, connecting now if it was not warmed, and keep it until
+        the next disconnect.
+
+        Returns:
+            Seconds spent waiting
+        """
+        start = time.perf_counter()
+        self.audio_active = True
+        self._reconnects_left = self.max_reconnects
+        self._cancel_idle_disconnect()
+        if not self.is_ready():
+            try:
+                await asyncio.shield(self._connect())
+            except Exception:
+                self.audio_active = False
+                raise
+        return time.perf_counter() - start
+
+    async def disconnect(self) -> None:
+        """
+        Disconnect without reconnecting, until the next prewarm.
+        """
+        self.closed = True
+        self.audio_active = False
+        self._cancel_idle_disconnect()
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._capture_conversation()
+        if self.client.is_connected():
+            await self.client.disconnect()
+
+    def _connect(self) -> asyncio.Task:
+        if self._task is None or (self._task.done() and not self.is_ready()):
+            self.closed = False
+            self._task = asyncio.create_task(self._connect_with_retries())
+            self._task.add_done_callback(self._on_connect_done)
+        return self._task
+
+    def _schedule_idle_disconnect(self) -> None:
+        self._cancel_idle_disconnect()
+        if self.idle_seconds:
+            self._idle_timer = asyncio.get_running_loop().call_later(self.idle_seconds, self._on_idle)
+
+    def _cancel_idle_disconnect(self) -> None:
+        if self._idle_timer:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _on_idle(self) -> None:
+        self._idle_timer = None
+        if self.audio_active or self.closed:
+            return
+        logger.info(f"Closing the realtime connection, unused for {self.idle_seconds:.0f}s")
+        self.stats["idle_disconnects"] += 1
+        self._idle_task = asyncio.create_task(self.disconnect())
+
+    async def _connect_with_retries(self) -> None:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(self.backoff_seconds * 2 ** (attempt - 1), REALTIME_CONNECT_MAX_BACKOFF_SECONDS))
+            try:
+                await self.client.connect()
+                await self.client.wait_for_session_created()
+                if self.conversation_log:
+                    await self.client.create_conversation_items(self.conversation_log.replay_items())
+                self.stats["connects"] += 1
+                return
+            except asyncio.CancelledError:
+                await self.client.disconnect()
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to connect to OpenAI realtime (attempt {attempt + 1}): {e}")
+                await self.client.disconnect()
+                if attempt == self.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+
+    def _on_connect_done(self, task: asyncio.Task) -> None:
+        # Retrieve the exception so a warmup nobody waited for is not reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    def _capture_conversation(self) -> None:
+        if self.conversation_log:
+            self.conversation_log.capture(self.client.conversation.get_items())
+        # The next connection starts from the replayed log, not from the items of this one
+        self.client.conversation.clear()
+
+    def _on_connection_closed(self, event) -> None:
+        if self.closed:
+            return
+        self._capture_conversation()
+        if self._reconnects_left <= 0:
+            logger.warning(
+                f"Realtime connection closed ({event.get('code')}), not reconnecting after {self.max_reconnects} "
+                "reconnects"
+            )
+            self.closed = True
+            return
+        logger.info(f"Realtime connection closed ({event.get('code')}), reconnecting")
+        self._reconnects_left -= 1
+        self.stats["reconnects"] += 1
+        self._connect()
@@ -0,0 +1,77 @@
+import json
+import os
+from typing import List, Optional
+
+
+CONVERSATION_LOG_MAX_ITEMS = int(os.getenv("CONVERSATION_LOG_MAX_ITEMS", 40))
+CONVERSATION_LOG_MAX_CHARS = int(os.getenv("CONVERSATION_LOG_MAX_CHARS", 8000))
+TOOL_OUTPUT_SUMMARY_CHARS = 300
+
+
+def summarize_tool_output(output: str, max_chars: int = TOOL_OUTPUT_SUMMARY_CHARS) -> str:
+    """
+    Shorten a tool output to a compact JSON string of at most max_chars.
+    """
+    try:
+        output = json.dumps(json.loads(output), separators=(",", ":"), ensure_ascii=False)
+    except (TypeError, ValueError):
+        pass
+    return output if len(output) <= max_chars else output[:max_chars - 3] + "..."
+
+
+def compact_item(item: dict) -> Optional[dict]:
+    """
+    Reduce a conversation item to its text, as {"role", "text"}. Audio without a transcript yet is dropped.
+    """
+    formatted = item.get("formatted", {})
+    if item["type"] == "message":
+        text = formatted.get("text") or formatted.get("transcript")
+        return {"role": item["role"], "text": text} if text else None
+    if item["type"] == "function_call":
+        return {"role": "system", "text": f"Called tool {item['name']}({item.get('arguments', '')})"}
+    if item["type"] == "function_call_output":
+        return {"role": "system", "text": f"Tool result: {summarize_tool_output(item['output'])}"}
+    return None
+
+
+class ConversationLog:
+    def __init__(self, max_items: int = CONVERSATION_LOG_MAX_ITEMS, max_chars: int = CONVERSATION_LOG_MAX_CHARS):
+        """
+        Text-only record of a session's conversation, kept across realtime connections so a new connection can be
+        given the context of the previous ones.
+
+        Args:
+            max_items: Maximum number of most recent entries replayed
+            max_chars: Maximum total length of the text replayed
+        """
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self.entries: List[dict] = []
+
+    def capture(self, items: List[dict]) -> None:
+        """
+        Record the items of the current connection, which start with the replay of the previous ones.
+        A connection without items leaves the log unchanged.
+        """
+        entries = [entry for entry in map(compact_item, items) if entry]
+        if entries:
+            self.entries = entries
+
+    def replay_items(self) -> List[dict]:
+        """
+        Conversation items re-creating the most recent entries, trimmed to max_items and max_chars.
+        """
+        entries, total_chars = [], 0
+        for entry in reversed(self.entries[-self.max_items:]):
+            total_chars += len(entry["text"])
+            if total_chars > self.max_chars:
+                break
+            entries.append(entry)
+        return [
+            {
+                "type": "message",
+                "role": entry["role"],
+                "content": [{"type": "text" if entry["role"] == "assistant" else "input_text", "text": entry["text"]}],
+            }
+            for entry in reversed(entries)
+        ]
@@ -0,0 +1,81 @@
+import asyncio
+import base64
+import hashlib
+import os
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from realtime import tracing
+from realtime.llm_cache import CompletionCache
+from realtime.vision import VisionModel
+
+
+IMAGE_UPLOAD_MAX_DIMENSION = int(os.getenv("IMAGE_UPLOAD_MAX_DIMENSION", 1024))
+IMAGE_UPLOAD_JPEG_QUALITY = int(os.getenv("IMAGE_UPLOAD_JPEG_QUALITY", 85))
+IMAGE_DESCRIPTION_CONCURRENCY = int(os.getenv("IMAGE_DESCRIPTION_CONCURRENCY", 4))
+
+# Descriptions of uploaded images by digest of the uploaded bytes, shared across sessions. The only cache of these
+# descriptions: they are not also kept in the vision model's completion cache.
+image_descriptions = CompletionCache()
+_describe_semaphore = asyncio.Semaphore(IMAGE_DESCRIPTION_CONCURRENCY)
+
+
+def read_upload(source: str) -> Tuple[Optional[bytes], str]:
+    """
+    Read an uploaded image, from a file path or a data URI, and hash its bytes.
+
+    Returns:
+        Bytes of the image, None for URLs the model fetches itself, and the cache key of the image
+    """
+    if source.startswith("http"):
+        return None, f"url:{source}"
+    if source.startswith("data:"):
+        data = base64.b64decode(source.split(",", 1)[1])
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    return data, f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+def downscale_to_data_uri(
+    data: bytes,
+    max_dimension: int = IMAGE_UPLOAD_MAX_DIMENSION,
+    quality: int = IMAGE_UPLOAD_JPEG_QUALITY,
+) -> str:
+    """
+    Encode an image as a data URI, scaled down to fit max_dimension so it uploads and is processed faster.
+    Images that already fit are sent as uploaded.
+    """
+    image = Image.open(BytesIO(data))
+    if max(image.size) <= max_dimension and image.format in ("JPEG", "PNG", "WEBP"):
+        return f"data:{Image.MIME[image.format]};base64," + base64.b64encode(data).decode("utf-8")
+    image.thumbnail((max_dimension, max_dimension))
+    buffer = BytesIO()
+    image.convert("RGB").save(buffer, "JPEG", quality=quality)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+async def describe_image(vision_model: VisionModel, source: str) -> str:
+    """
+    Describe an uploaded image, reusing the description of an identical upload.
+    Concurrent uploads of the same image are described once.
+    """
+    data, digest = await asyncio.to_thread(read_upload, source)
+
+    async def describe():
+        async with _describe_semaphore:
+            with tracing.span("image.describe"):
+                image = await asyncio.to_thread(downscale_to_data_uri, data) if data is not None else source
+                return await vision_model.generate_image_description(image, cached=False)
+
+    return await image_descriptions.get_or_create(f"{vision_model.model_name}:{digest}", describe)
+
+
+async def describe_images(vision_model: VisionModel, sources: List[str]) -> List[str]:
+    """
+    Describe the images uploaded with a message concurrently, at most IMAGE_DESCRIPTION_CONCURRENCY at a time
+    across all sessions, so several images take about the time of one.
+    """
+    return await asyncio.gather(*(describe_image(vision_model, source) for source in sources))
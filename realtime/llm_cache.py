@@ -0,0 +1,121 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+
+VISION_CACHE_MAX_ENTRIES = int(os.getenv("VISION_CACHE_MAX_ENTRIES", 1024))
+VISION_CACHE_TTL_SECONDS = float(os.getenv("VISION_CACHE_TTL_SECONDS", 3600 * 6))
+
+
+def _canonicalize(value: Any) -> Any:
+    """
+    Replace data URIs with a digest of the data they contain, so the same image hashes the same way no matter
+    how it was encoded, and without keeping the image in the key.
+    """
+    if isinstance(value, dict):
+        return {k: _canonicalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(v) for v in value]
+    if isinstance(value, str) and value.startswith("data:") and ";base64," in value:
+        data = base64.b64decode(value.split(";base64,", 1)[1])
+        return f"sha256:{hashlib.sha256(data).hexdigest()}"
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return {"name": value.__name__, "schema": value.model_json_schema()}
+    return repr(value)
+
+
+class CompletionCache:
+    def __init__(self, max_entries: int = VISION_CACHE_MAX_ENTRIES, ttl_seconds: float = VISION_CACHE_TTL_SECONDS):
+        """
+        In-process LRU cache of deterministic LLM completions, shared across sessions.
+        Concurrent identical calls are coalesced into a single call.
+
+        Args:
+            max_entries: Maximum number of cached completions
+            ttl_seconds: Time after which a cached completion expires
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(**kwargs) -> str:
+        """
+        Hash the completion arguments, i.e. the model name, messages and sampling parameters.
+        """
+        canonical = json.dumps(_canonicalize(kwargs), sort_keys=True, default=_json_default)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def hit_ratio(self) -> float:
+        lookups = self.stats["hits"] + self.stats["coalesced"] + self.stats["misses"]
+        return (self.stats["hits"] + self.stats["coalesced"]) / lookups if lookups else 0.0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get the cached value for the key, or create it with the factory and cache it. Failures are not cached.
+        The call runs in its own task, so a cancelled caller does not cancel it for coalesced callers.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._create(key, factory))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _create(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        value = await factory()
+        self.set(key, value)
+        return value
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Retrieve the exception so it is not reported as unhandled when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+
+completion_cache = CompletionCache()
@@ -0,0 +1,83 @@
+import base64
+import hashlib
+import threading
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+
+MODEL_IMAGE_PATH = "static/images/patrick_model.jpg"
+MODEL_IMAGE_MAX_SIZE = (1191, 2014)
+MODEL_IMAGE_JPEG_QUALITY = 90
+
+
+@dataclass(frozen=True)
+class ModelImage:
+    """A preprocessed model image, ready to be sent to the try-on API."""
+    base64: str
+    size: Tuple[int, int]
+    digest: str
+
+
+def preprocess_model_image(image: Union[str, bytes], max_size: Tuple[int, int] = MODEL_IMAGE_MAX_SIZE) -> ModelImage:
+    """
+    Orient, convert to RGB, downscale to fit within max_size and JPEG-encode a model image.
+
+    Args:
+        image: Path to the image or the raw image bytes
+        max_size: Maximum (width, height) of the normalised image
+    """
+    img = Image.open(image if isinstance(image, str) else BytesIO(image))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail(max_size)
+
+    buffer = BytesIO()
+    img.save(buffer, "JPEG", quality=MODEL_IMAGE_JPEG_QUALITY)
+    encoded = buffer.getvalue()
+    return ModelImage(
+        base64=base64.b64encode(encoded).decode("utf-8"),
+        size=img.size,
+        digest=hashlib.md5(encoded).hexdigest(),
+    )
+
+
+class ModelImageRegistry:
+    def __init__(self, default_image: str = MODEL_IMAGE_PATH):
+        """
+        Registry of preprocessed model images per user, so each upload is only decoded and encoded once.
+
+        Args:
+            default_image: Path to the model image used for users that have not uploaded one
+        """
+        self.default_image = default_image
+        self._default: Optional[ModelImage] = None
+        self._images: Dict[str, ModelImage] = {}
+        self._lock = threading.Lock()
+
+    def register(self, user_id: str, image: Union[str, bytes]) -> ModelImage:
+        """
+        Preprocess and store the model image of a user, replacing any previous one.
+        """
+        model_image = preprocess_model_image(image)
+        self._images[user_id] = model_image
+        return model_image
+
+    def remove(self, user_id: str) -> None:
+        self._images.pop(user_id, None)
+
+    def get(self, user_id: Optional[str] = None) -> ModelImage:
+        """
+        Get the model image of a user, falling back to the default model image.
+        """
+        if user_id in self._images:
+            return self._images[user_id]
+        if self._default is None:
+            with self._lock:
+                if self._default is None:
+                    self._default = preprocess_model_image(self.default_image)
+        return self._default
+
+
+model_images = ModelImageRegistry()
@@ -1,8 +1,11 @@
 # Create new index
 import asyncio
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 
 import chainlit as cl
 import cohere
@@ -10,21 +13,61 @@ import pandas as pd
 from pinecone import Pinecone, ServerlessSpec
 from tqdm import tqdm
 
+from realtime import tracing
+from realtime.vision import image_to_data_uri
+
 
 AWS_REGION = "us-west-2"
 MODEL_NAME = "embed-multilingual-light-v3.0"
 PRODUCT_INDEX_NAME = "products"
 PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
 COHERE_API_KEY = os.environ.get('COHERE_API_KEY')
+METADATA_COLUMNS = [
+    'colour_group_name',
+    'product_type_name',
+    'index_name',
+    'section_name',
+    'on_sale'
+]
+# Image embeddings of the products, kept apart from the product descriptions that are searched
+IMAGE_EMBEDDINGS_NAMESPACE = "images"
+# The embedding API takes one image per request, and rate limits them
+IMAGE_EMBED_REQUESTS_PER_MINUTE = float(os.getenv("IMAGE_EMBED_REQUESTS_PER_MINUTE", 24))
+IMAGE_EMBED_CONCURRENCY = int(os.getenv("IMAGE_EMBED_CONCURRENCY", 4))
+IMAGE_EMBED_RETRIES = 3
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float):
+        """
+        Space the requests made from any number of threads evenly, at most requests_per_minute.
+
+        Args:
+            requests_per_minute: Maximum rate of requests, unlimited if 0
+        """
+        self.interval = 60 / requests_per_minute if requests_per_minute else 0
+        self._lock = threading.Lock()
+        self._next_request_time = 0.0
+
+    def wait(self) -> None:
+        """Block until the calling thread may make its request."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            request_time = max(now, self._next_request_time)
+            self._next_request_time = request_time + self.interval
+        time.sleep(request_time - now)
 
 
 class MetadataSearch:
-    def __init__(self, column_name: str):
+    def __init__(self, column_name: str, existing_indexes: Optional[List[str]] = None):
         """
         Initialize metadata search for a specific column.
         
         Args:
             column_name: Name of the column to search within
+            existing_indexes: Names of the existing Pinecone indexes, listed if not provided
             PINECONE_API_KEY: Optional API key for Pinecone (defaults to environment variable)
             COHERE_API_KEY: Optional API key for Cohere (defaults to environment variable)
         """
@@ -33,17 +76,19 @@ class MetadataSearch:
         self.co = cohere.Client(COHERE_API_KEY or os.environ.get('COHERE_API_KEY'))
         self.embedding_dimension = 384  # Cohere embed-multilingual-light-v3.0 dimension
         self.index = None
-        self.create_index()
+        self.create_index(existing_indexes)
 
-    def create_index(self) -> None:
+    def create_index(self, existing_indexes: Optional[List[str]] = None) -> None:
         """
         Create a new Pinecone index if it doesn't exist and connect to it.
         
         Args:
-            index_name: Name of the Pinecone index to create/connect to
+            existing_indexes: Names of the existing Pinecone indexes, listed if not provided
         """
         index_name = (self.column_name + "_index").replace("_", "-").lower()
-        if index_name not in self.pc.list_indexes().names():
+        if existing_indexes is None:
+            existing_indexes = self.pc.list_indexes().names()
+        if index_name not in existing_indexes:
             self.pc.create_index(
                 name=index_name,
                 dimension=self.embedding_dimension,
@@ -182,7 +227,8 @@ class MetadataSearch:
         query: str, 
         top_k: int = 5,
         score_threshold: float = 0.6,
-        existing_filters: Optional[Dict] = None
+        existing_filters: Optional[Dict] = None,
+        image_embedding: Optional[List[float]] = None
     ) -> Dict:
         """
         Generate Pinecone filters based on a text query for a specific column.
@@ -192,6 +238,7 @@ class MetadataSearch:
             top_k: Number of top values to consider for filtering
             score_threshold: Minimum similarity score to consider a match
             existing_filters: Optional existing filters to combine with
+            image_embedding: Precomputed embedding of the image searched with, used instead of embedding the query
             
         Returns:
             Dict containing Pinecone-compatible filter
@@ -199,32 +246,38 @@ class MetadataSearch:
         if not self.index:
             raise ValueError("Index not initialized. Call create_index() first.")
 
-        query_embedding = self.calculate_query_embedding(query)
+        if image_embedding is not None:
+            query_embedding = image_embedding
+        else:
+            with tracing.span("search.filter.embed", column=self.column_name):
+                query_embedding = self.calculate_query_embedding(query)
 
         # Query metadata vectors
         base_filter = {"embedding_type": {"$eq": "metadata"}}
         if existing_filters:
             base_filter.update(existing_filters)
             
-        results = self.index.query(
-            vector=query_embedding,
-            filter=base_filter,
-            top_k=top_k,
-            include_metadata=True
-        )
+        with tracing.span("search.filter.query", column=self.column_name):
+            results = self.index.query(
+                vector=query_embedding,
+                filter=base_filter,
+                top_k=top_k,
+                include_metadata=True
+            )
 
         # Analyze the matches
         value_scores = [(match.metadata['value'], match.score) 
                        for match in results.matches 
                        if match.score >= score_threshold]
         
-        if not query.startswith("data:image"):
+        if image_embedding is None and not query.startswith("data:image"):
             vision_model = cl.user_session.get("vision_model")
-            relevant_values = await vision_model.filter_metadata_filter(
-                query=query,
-                filter_category=self.column_name,
-                filter_values=[v[0] for v in value_scores]
-            )
+            with tracing.span("search.filter.llm", column=self.column_name):
+                relevant_values = await vision_model.filter_metadata_filter(
+                    query=query,
+                    filter_category=self.column_name,
+                    filter_values=[v[0] for v in value_scores]
+                )
             value_scores = [v for v in value_scores if v[0] in relevant_values]
         
         if len(value_scores) == 0:
@@ -269,17 +322,25 @@ class ProductSearch:
     }
     
     def __init__(self):
-        """Initialize the ProductSearch system using environment variables."""
+        """
+        Initialize the ProductSearch system using environment variables.
+        The indexes are listed once, and the product index and metadata searchers are connected to concurrently.
+        """
         self.pc = Pinecone(api_key=PINECONE_API_KEY)
         self.co = cohere.Client(COHERE_API_KEY)
         self.embedding_dimension = 384  # Cohere embed-multilingual-light-v3.0 dimension
         self.metadata_searchers = {}
-        self.create_index()
-        self.init_metadata_searchers()
+        existing_indexes = self.pc.list_indexes().names()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            index_created = executor.submit(self.create_index, existing_indexes)
+            self.init_metadata_searchers(existing_indexes)
+            index_created.result()
         
-    def create_index(self) -> None:
+    def create_index(self, existing_indexes: Optional[List[str]] = None) -> None:
         """Create a new Pinecone index for products if it doesn't exist."""
-        if PRODUCT_INDEX_NAME not in self.pc.list_indexes().names():
+        if existing_indexes is None:
+            existing_indexes = self.pc.list_indexes().names()
+        if PRODUCT_INDEX_NAME not in existing_indexes:
             self.pc.create_index(
                 name=PRODUCT_INDEX_NAME,
                 dimension=self.embedding_dimension,
@@ -323,28 +384,6 @@ class ProductSearch:
                 model=MODEL_NAME,
             ).embeddings
         
-        # Prepare image embeddings batch
-        # valid_images = []
-        # image_indices = []
-        
-        # for idx, row in batch_df.iterrows():
-        #     image_path = os.path.join(images_dir, f"0{row['article_id']}.jpg")
-            
-        #     if os.path.exists(image_path):
-        #         processed_image = image_to_data_uri(image_path)
-        #         valid_images.append(processed_image)
-        #         image_indices.append(idx)
-        
-        # if valid_images:
-        #     image_embeddings = []
-        #     for img in valid_images:
-        #         image_embeddings.extend(self.co.embed(
-        #             model=MODEL_NAME,
-        #             images=[img],
-        #             input_type='image'
-        #         ).embeddings)
-        #         time.sleep(2.5)  # Sleep to avoid rate limiting
-        
         # Create upsert tuples for text embeddings
         for embed_idx, df_idx in enumerate(valid_indices):
             row = batch_df.loc[df_idx]
@@ -375,35 +414,6 @@ class ProductSearch:
                 {**metadata, 'embedding_type': 'text'}
             ))
         
-        # Create upsert tuples for image embeddings
-        # for embed_idx, df_idx in enumerate(image_indices):
-        #     row = batch_df.iloc[df_idx]
-        #     metadata = {
-        #         'article_id': str(row['article_id']),
-        #         'product_code': str(row['product_code']),
-        #         'prod_name': row['prod_name'],
-        #         'detail_desc': row['detail_desc'],
-        #         'colour_group_code': str(row['colour_group_code']),
-        #         'colour_group_name': row['colour_group_name'],
-        #         'product_type_no': str(row['product_type_no']),
-        #         'product_type_name': row['product_type_name'],
-        #         'product_group_name': row['product_group_name'],
-        #         'index_code': str(row['index_code']),
-        #         'index_name': row['index_name'],
-        #         'index_group_no': str(row['index_group_no']),
-        #         'index_group_name': row['index_group_name'],
-        #         'section_no': str(row['section_no']),
-        #         'section_name': row['section_name'],
-        #         'yaml_description': self._create_yaml_description(row),  # Store the YAML description in metadata
-        #         'image': valid_images[df_idx],
-        #     }
-            
-        #     to_upsert.append((
-        #         f"image_{row['article_id']}", 
-        #         image_embeddings[embed_idx],
-        #         {**metadata, 'embedding_type': 'image'}
-        #     ))
-            
         return to_upsert
     
     def add_products(self, 
@@ -434,34 +444,132 @@ class ProductSearch:
             if to_upsert:
                 self.index.upsert(vectors=to_upsert)
 
+    def embed_image(self, image: str) -> List[float]:
+        """
+        Embed a product image, given as a path or a data URI, in the space of the product descriptions.
+        """
+        return self.co.embed(
+            model=MODEL_NAME,
+            images=[image_to_data_uri(image)],
+            input_type='image'
+        ).embeddings[0]
+
+    def stored_image_embeddings(self, article_ids: List[str]) -> Set[str]:
+        """article_ids, among the given ones, of the products whose image embedding is stored."""
+        response = self.index.fetch(
+            ids=[f"image_{article_id}" for article_id in article_ids],
+            namespace=IMAGE_EMBEDDINGS_NAMESPACE
+        )
+        return {vector_id[len("image_"):] for vector_id in response.vectors}
+
+    def add_image_embeddings(self,
+                             products_df: pd.DataFrame,
+                             images_dir: str,
+                             batch_size: int = 96,
+                             max_workers: int = IMAGE_EMBED_CONCURRENCY,
+                             requests_per_minute: float = IMAGE_EMBED_REQUESTS_PER_MINUTE,
+                             overwrite: bool = False) -> int:
+        """
+        Embed the image of every product and store it in the image namespace of the product index as
+        image_{article_id}, so that similar products are found by looking the vector up instead of embedding the
+        image at query time. Images are embedded by max_workers threads, at most requests_per_minute, retrying the
+        requests that are rate limited. Products whose image embedding is stored are skipped unless overwrite is set,
+        so that an interrupted run resumes where it stopped.
+
+        Args:
+            products_df: DataFrame with product metadata
+            images_dir: Directory containing product images named as 0{article_id}.jpg
+            batch_size: Number of products to upsert at once
+            max_workers: Number of images embedded concurrently
+            requests_per_minute: Maximum rate of embedding requests, unlimited if 0
+            overwrite: Embed the images of the products already embedded again
+
+        Returns:
+            Number of images embedded
+        """
+        rate_limiter = RateLimiter(requests_per_minute)
+
+        def embed(image_path: str) -> List[float]:
+            for attempt in range(IMAGE_EMBED_RETRIES + 1):
+                rate_limiter.wait()
+                try:
+                    return self.embed_image(image_path)
+                except cohere.TooManyRequestsError:
+                    if attempt == IMAGE_EMBED_RETRIES:
+                        raise
+                    time.sleep(2 ** attempt)
+
+        total_batches = len(products_df) // batch_size + (1 if len(products_df) % batch_size != 0 else 0)
+        embedded = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch_start in tqdm(range(0, len(products_df), batch_size),
+                                    total=total_batches,
+                                    desc="Embedding product images"):
+                article_ids = [str(article_id) for article_id in
+                               products_df["article_id"].iloc[batch_start:batch_start + batch_size]]
+                stored = set() if overwrite else self.stored_image_embeddings(article_ids)
+                images = [
+                    (article_id, os.path.join(images_dir, f"0{article_id}.jpg"))
+                    for article_id in article_ids
+                    if article_id not in stored
+                ]
+                images = [(article_id, path) for article_id, path in images if os.path.exists(path)]
+                embeddings = executor.map(embed, [path for _, path in images])
+                to_upsert = [
+                    (f"image_{article_id}", embedding, {
+                        'article_id': article_id,
+                        'image': path,
+                        'embedding_type': 'image'
+                    })
+                    for (article_id, path), embedding in zip(images, embeddings)
+                ]
+                if to_upsert:
+                    self.index.upsert(vectors=to_upsert, namespace=IMAGE_EMBEDDINGS_NAMESPACE)
+                embedded += len(to_upsert)
+        return embedded
 
-    def init_metadata_searchers(self):
+    def fetch_image_embedding(self, article_id: str) -> Optional[List[float]]:
         """
-        Initialize metadata searchers for relevant columns
+        Look up the precomputed image embedding of a product.
+
+        Returns:
+            Embedding of the product image, or None if it has not been embedded
+        """
+        vector_id = f"image_{article_id}"
+        vector = self.index.fetch(ids=[vector_id], namespace=IMAGE_EMBEDDINGS_NAMESPACE).vectors.get(vector_id)
+        return list(vector.values) if vector else None
+
+    def init_metadata_searchers(self, existing_indexes: Optional[List[str]] = None):
+        """
+        Initialize metadata searchers for relevant columns concurrently, skipping those already initialized.
+
+        Args:
+            existing_indexes: Names of the existing Pinecone indexes, listed if not provided
         """
-        for column in [
-            'colour_group_name',
-            'product_type_name',
-            'index_name',
-            'section_name',
-            'on_sale'
-        ]:
-            searcher = MetadataSearch(column_name=column)
-            self.metadata_searchers[column] = searcher
+        columns = [column for column in METADATA_COLUMNS if column not in self.metadata_searchers]
+        if not columns:
+            return
+        if existing_indexes is None:
+            existing_indexes = self.pc.list_indexes().names()
+        with ThreadPoolExecutor(max_workers=len(columns)) as executor:
+            searchers = list(executor.map(lambda column: MetadataSearch(column, existing_indexes), columns))
+        self.metadata_searchers.update(zip(columns, searchers))
     
     async def generate_filters_from_query(
         self,
         query: str,
         top_k: int = 6,
-        score_threshold: float = 0.25
+        score_threshold: float = 0.25,
+        image_embedding: Optional[List[float]] = None
     ) -> Optional[Dict]:
         """
         Generate combined filters from a query across all metadata columns.
         
         Args:
-            query: User search query
+            query: User search query, or the image searched with
             top_k: Number of top values to consider per column
             score_threshold: Minimum similarity score to consider
+            image_embedding: Precomputed embedding of the image searched with, used instead of embedding the query
             
         Returns:
             Combined filter dict for Pinecone query
@@ -475,7 +583,8 @@ class ProductSearch:
             column_filter = searcher.search_for_value_filters(
                 query=query,
                 top_k=min(top_k, searcher.index_size),
-                score_threshold=score_threshold
+                score_threshold=score_threshold,
+                image_embedding=image_embedding
             )
             filters.append(column_filter)
 
@@ -0,0 +1,127 @@
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from realtime import services
+
+
+PRODUCT_CATALOG_CSV = os.getenv("PRODUCT_CATALOG_CSV", "data/product_catalog.csv")
+PRODUCT_CATALOG_IMAGES_DIR = os.getenv("PRODUCT_CATALOG_IMAGES_DIR", "data/product_catalog_images")
+# Catalog columns kept in memory, the ones read from search results by the tools and the renderer
+CATALOG_COLUMNS = [
+    'prod_name',
+    'detail_desc',
+    'colour_group_name',
+    'product_type_name',
+    'product_group_name',
+    'index_name',
+    'index_group_name',
+    'section_name',
+    'on_sale'
+]
+ON_SALE_LABELS = {0: "Regular Price", 1: "On Sale"}
+
+
+class ProductCatalog:
+    def __init__(self, products_df: pd.DataFrame, images_dir: str = PRODUCT_CATALOG_IMAGES_DIR):
+        """
+        In-memory product catalog shared by all sessions. Every column is dictionary encoded, as a NumPy array of
+        the smallest integer codes and the list of distinct values, since colour, type and section names repeat
+        across the catalog and descriptions are shared by the variants of a product.
+
+        Args:
+            products_df: Catalog, with the columns of data/product_catalog.csv
+            images_dir: Directory containing product images named as 0{article_id}.jpg
+        """
+        self.images_dir = images_dir
+        self.article_ids = products_df["article_id"].astype(str).to_numpy()
+        self.rows: Dict[str, int] = {article_id: row for row, article_id in enumerate(self.article_ids)}
+        self.codes: Dict[str, np.ndarray] = {}
+        self.categories: Dict[str, np.ndarray] = {}
+        self._category_codes: Dict[str, Dict[str, int]] = {}
+        for column in CATALOG_COLUMNS:
+            if column not in products_df:
+                continue
+            values = products_df[column]
+            if column == "on_sale" and pd.api.types.is_numeric_dtype(values):
+                values = values.map(ON_SALE_LABELS)
+            categorical = pd.Categorical(values.fillna("").astype(str))
+            self.codes[column] = categorical.codes
+            self.categories[column] = categorical.categories.to_numpy()
+            self._category_codes[column] = {value: code for code, value in enumerate(self.categories[column])}
+
+    @classmethod
+    def from_csv(cls, path: str = PRODUCT_CATALOG_CSV, images_dir: str = PRODUCT_CATALOG_IMAGES_DIR) -> "ProductCatalog":
+        return cls(pd.read_csv(path, usecols=lambda column: column == "article_id" or column in CATALOG_COLUMNS),
+                   images_dir)
+
+    def __len__(self) -> int:
+        return len(self.article_ids)
+
+    def __contains__(self, article_id: str) -> bool:
+        return str(article_id) in self.rows
+
+    def metadata(self, article_id: str) -> dict:
+        """
+        Metadata of a product, with the same fields as in the search results.
+        """
+        row = self.rows[str(article_id)]
+        metadata = {column: self.categories[column][codes[row]] for column, codes in self.codes.items()}
+        metadata["article_id"] = self.article_ids[row]
+        metadata["image"] = os.path.join(self.images_dir, f"0{self.article_ids[row]}.jpg")
+        return metadata
+
+    def get(self, article_id: str) -> dict:
+        """
+        Get a product in the shape of a search match.
+        """
+        return {"id": str(article_id), "metadata": self.metadata(article_id)}
+
+    def mask(self, filt: Optional[dict]) -> np.ndarray:
+        """
+        Evaluate a metadata filter, as generated for the product index, on every product.
+
+        Returns:
+            Boolean array of the products matching the filter
+        """
+        if not filt:
+            return np.ones(len(self), dtype=bool)
+        mask = np.ones(len(self), dtype=bool)
+        for key, condition in filt.items():
+            if key == "$and":
+                for sub_filter in condition:
+                    mask &= self.mask(sub_filter)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self.mask(sub_filter) for sub_filter in condition])
+            elif key not in self.codes:
+                # As in the index, a field products do not have matches nothing
+                mask[:] = False
+            else:
+                for operator, value in condition.items():
+                    mask &= self._column_mask(key, operator, value)
+        return mask
+
+    def _column_mask(self, column: str, operator: str, value) -> np.ndarray:
+        category_codes = self._category_codes[column]
+        if operator in ("$eq", "$ne"):
+            matches = self.codes[column] == category_codes.get(str(value), -2)
+            return matches if operator == "$eq" else ~matches
+        if operator in ("$in", "$nin"):
+            codes = [category_codes[str(v)] for v in value if str(v) in category_codes]
+            matches = np.isin(self.codes[column], codes)
+            return matches if operator == "$in" else ~matches
+        raise ValueError(f"Unsupported filter operator {operator}")
+
+    def count(self, filt: Optional[dict]) -> int:
+        return int(np.count_nonzero(self.mask(filt)))
+
+    def filter(self, filt: Optional[dict], limit: Optional[int] = None) -> List[str]:
+        """
+        article_ids of the products matching a metadata filter, in catalog order.
+        """
+        return self.article_ids[self.mask(filt)][:limit].tolist()
+
+
+product_catalog = services.register("product_catalog", ProductCatalog.from_csv)
@@ -0,0 +1,99 @@
+import sys
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping
+
+import chainlit as cl
+
+from realtime.product_search.base import METADATA_COLUMNS
+from realtime.product_search.catalog import product_catalog
+
+
+# Search-time fields that no tool reads once the results are shown
+DROPPED_FIELDS = ("yaml_description", "embedding_type")
+# Fields the realtime model is told about, after the product's position and name
+TOOL_OUTPUT_FIELDS = ("colour_group_name", "product_type_name", "section_name")
+INTERNED_FIELDS = (*METADATA_COLUMNS, "product_group_name", "index_group_name")
+
+
+class ProductTable:
+    def __init__(self):
+        """
+        Read-only product metadata shared by every session, keyed by article_id, so sessions keep article_ids
+        rather than copies of the search results. Products are read from the product catalog once it is loaded.
+        Until then, or for products missing from it, they are added from search results, without the fields only
+        used by the search, and their low-cardinality values are interned so that products share them.
+        """
+        self._products: Dict[str, Mapping[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def add(self, matches: Iterable[Any]) -> List[str]:
+        """
+        Add the products of search matches, keeping the metadata already stored for known products.
+
+        Returns:
+            article_ids of the matches, in order
+        """
+        article_ids = []
+        for match in matches:
+            metadata = match["metadata"]
+            article_id = str(metadata["article_id"])
+            if article_id not in self._products and not self._in_catalog(article_id):
+                self._products[article_id] = MappingProxyType({
+                    key: sys.intern(value) if key in INTERNED_FIELDS and isinstance(value, str) else value
+                    for key, value in metadata.items()
+                    if key not in DROPPED_FIELDS
+                })
+            article_ids.append(article_id)
+        return article_ids
+
+    def get(self, article_id: str) -> dict:
+        """
+        Get a product in the shape of a search match, with its read-only metadata.
+        """
+        if article_id in self._products:
+            return {"id": article_id, "metadata": self._products[article_id]}
+        if self._in_catalog(article_id):
+            return product_catalog.get().get(article_id)
+        raise KeyError(f"Unknown product {article_id}")
+
+    @staticmethod
+    def _in_catalog(article_id: str) -> bool:
+        # The catalog is loaded in the background at startup, and not waited for here
+        return product_catalog.initialized and article_id in product_catalog.get()
+
+    def get_many(self, article_ids: Iterable[str]) -> List[dict]:
+        return [self.get(article_id) for article_id in article_ids]
+
+
+product_table = ProductTable()
+
+
+def set_latest_products(matches: Iterable[Any]) -> List[dict]:
+    """
+    Store the products just recommended to the current user session, returning them from the product table.
+    """
+    article_ids = product_table.add(matches)
+    cl.user_session.set("latest_product_ids", article_ids)
+    return product_table.get_many(article_ids)
+
+
+def get_latest_products() -> List[dict]:
+    """
+    Get the products last recommended to the current user session.
+    """
+    return product_table.get_many(cl.user_session.get("latest_product_ids", []))
+
+
+def format_products_for_model(products: List[dict]) -> str:
+    """
+    Describe products to the realtime model in as few tokens as it needs to talk about them and refer to them:
+    their position in the UI, name, colour, type and department.
+    """
+    lines = []
+    for i, product in enumerate(products, start=1):
+        metadata = product["metadata"]
+        details = ", ".join(str(metadata[field]) for field in TOOL_OUTPUT_FIELDS if metadata.get(field))
+        lines.append(f"{i}. {metadata['prod_name']} ({details})" if details else f"{i}. {metadata['prod_name']}")
+    return "\n".join(lines)
@@ -0,0 +1,113 @@
+import re
+from typing import List, Optional, Set
+
+
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5,
+    "sixth": 6, "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10,
+}
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+NUMBER = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+# Recommendations are shown one below the other, in order
+POSITION_PATTERNS = [
+    (re.compile(r"\b(second|2nd)[- ](to[- ])?last\b|\bpenultimate\b"), -2),
+    (re.compile(r"\b(last|final|bottom[- ]?most|lowest)\b"), -1),
+    (re.compile(r"\b(bottom|lower)[- ]?(one|item|product)\b|\b(at|on) the bottom\b"), -1),
+    (re.compile(r"\b(top[- ]?most|upper[- ]?most)\b"), 1),
+    (re.compile(r"\b(top|upper)[- ]?(one|item|product)\b|\b(at|on) the top\b"), 1),
+]
+NUMBERED_PATTERN = re.compile(
+    r"\b(?:number|item|product|option|recommendation|choice)\s*#?\s*" + NUMBER + r"\b|#\s*(\d+)\b"
+)
+# "the one that isn't blue", "not the red dress", "anything except the first": left to the LLM
+NEGATION_PATTERN = re.compile(
+    r"\b(not|never|neither|nor|other than|except|excluding|besides|instead of|rather than)\b|n['’]t\b"
+)
+ORDINAL_PATTERN = re.compile(r"\b(" + "|".join(ORDINALS) + r"|\d+(?:st|nd|rd|th))\b")
+STOPWORDS = {
+    "a", "an", "the", "one", "ones", "that", "this", "with", "in", "of", "and", "or", "for", "it", "i", "me", "my",
+    "like", "want", "please", "product", "item", "recommendation", "recommended", "shown", "showed", "on", "to",
+}
+
+
+def tokenize(text: str) -> Set[str]:
+    """
+    Lowercase words of a text, singularized by dropping a trailing s, without stopwords.
+    """
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return {word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+            for word in words if word not in STOPWORDS}
+
+
+def _position(description: str, num_products: int) -> Optional[int]:
+    """
+    Index of the product referenced by its position, i.e. "the second one", "number 3" or "the last one".
+    None if no position is referenced or if several different ones are.
+    """
+    text = description.lower().strip()
+    positions = set()
+    if re.fullmatch(r"#?\s*\d+", text):
+        positions.add(int(text.lstrip("#").strip()))
+    for pattern, position in POSITION_PATTERNS:
+        if pattern.search(text):
+            positions.add(num_products + 1 + position if position < 0 else position)
+            # So that "the second to last" is not also read as "the second" and "the last"
+            text = pattern.sub(" ", text)
+    for match in NUMBERED_PATTERN.finditer(text):
+        number = match.group(1) or match.group(2)
+        positions.add(NUMBER_WORDS.get(number) or int(number))
+    for match in ORDINAL_PATTERN.finditer(text):
+        ordinal = match.group(1)
+        positions.add(ORDINALS.get(ordinal) or int(re.match(r"\d+", ordinal).group()))
+    if re.search(r"\bmiddle\b", text) and num_products % 2 == 1:
+        positions.add(num_products // 2 + 1)
+    indices = {position - 1 for position in positions if 1 <= position <= num_products}
+    return indices.pop() if len(indices) == 1 and len(positions) == 1 else None
+
+
+def _attributes(description: str, products: List[dict]) -> Optional[int]:
+    """
+    Index of the product whose name, colour and type share the most words with the description, preferring the
+    closest colour, i.e. "Blue" over "Dark Blue" for "the blue one". None if no product shares any word or if
+    several match equally well.
+    """
+    # Numbers and ordinals are positions, not names
+    words = {word for word in tokenize(description) if not word.isdigit() and word not in ORDINALS}
+    scores = []
+    for product in products:
+        metadata = product["metadata"]
+        colour_words = tokenize(str(metadata.get("colour_group_name", "")))
+        product_words = colour_words | tokenize(
+            f"{metadata.get('prod_name', '')} {metadata.get('product_type_name', '')}"
+        )
+        unmatched_colour_words = len(colour_words - words) if colour_words & words else 0
+        scores.append((len(words & product_words), -unmatched_colour_words))
+    best = max(scores, default=(0, 0))
+    if best[0] == 0 or scores.count(best) > 1:
+        return None
+    return scores.index(best)
+
+
+def resolve_product_reference(description: str, products: List[dict]) -> Optional[int]:
+    """
+    Resolve a user's reference to one of the products last recommended, without calling a model: by position
+    ("the second one", "number 3", "the last one") or by name, colour and type ("the blue shirt").
+
+    Returns:
+        0-based index of the product, or None if the reference is ambiguous, negated or not understood
+    """
+    if NEGATION_PATTERN.search(description.lower()):
+        return None
+    if len(products) == 1:
+        return 0
+    if not products:
+        return None
+    by_position = _position(description, len(products))
+    by_attributes = _attributes(description, products)
+    if by_position is not None and by_attributes is not None and by_position != by_attributes:
+        # i.e. "the second one, the red dress" when the red dress is shown third
+        return None
+    return by_position if by_position is not None else by_attributes
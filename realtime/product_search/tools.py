@@ -1,16 +1,22 @@
-from typing import Dict, List
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
 
 import asyncio
 import aiohttp
 import chainlit as cl
 import requests
+from chainlit.logger import logger
+from realtime import services, tracing
 from realtime.product_search.base import ProductSearch, MODEL_NAME
-from realtime.vision import image_to_data_uri
+from realtime.product_search.catalog import product_catalog
+from realtime.product_search.product_table import format_products_for_model, get_latest_products, set_latest_products
+from realtime.try_on_warmup import get_session_warmup
 from pydantic import BaseModel
 
 
-product_search = ProductSearch()
+product_search = services.register("product_search", ProductSearch)
 top_k = 4
+RERANK_TIMEOUT_SECONDS = float(os.getenv("RERANK_TIMEOUT_SECONDS", 4))
 
 
 async def async_post_aiohttp(url, data):
@@ -21,6 +27,57 @@ async def async_post_aiohttp(url, data):
     )
 
 
+async def rerank_with_fallback(rerank: Callable[[], Awaitable[List[int]]], num_products: int) -> List[int]:
+    """
+    Rerank the products within the latency budget, falling back to the dense score order if the reranker
+    fails, times out or filters out every product.
+
+    Returns:
+        1-based indices of the products in order of relevance
+    """
+    dense_order = list(range(1, num_products + 1))
+    if num_products == 0:
+        return dense_order
+    with tracing.span("search.rerank", products=num_products) as span:
+        try:
+            indices = await asyncio.wait_for(rerank(), timeout=RERANK_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"Reranking timed out after {RERANK_TIMEOUT_SECONDS}s, using the dense order")
+            span.set(fallback="timeout")
+            return dense_order
+        except Exception as e:
+            logger.warning(f"Reranking failed, using the dense order: {e}")
+            span.set(fallback="error")
+            return dense_order
+        if not indices:
+            span.set(fallback="empty")
+        return indices or dense_order
+
+
+def query_index(product_search_client: ProductSearch, query_embedding: List[float], filt: Optional[dict]):
+    """
+    Query the product index with the filter, or without it if no product matches it. The catalog tells whether
+    any product matches once it is loaded, saving the round trip of a query that returns nothing.
+    """
+    with tracing.span("search.query") as span:
+        if filt and product_catalog.initialized and product_catalog.get().count(filt) == 0:
+            span.set(filter_skipped=True)
+            filt = None
+        results = product_search_client.index.query(
+            vector=query_embedding,
+            filter=filt,
+            top_k=top_k,
+            include_metadata=True
+        )
+        if filt and len(results["matches"]) == 0:
+            results = product_search_client.index.query(
+                vector=query_embedding,
+                top_k=top_k,
+                include_metadata=True
+            )
+    return results
+
+
 class SearchByTextQuery(BaseModel):
     """
     Search products using text query with optional metadata filters.
@@ -44,51 +101,44 @@ class SearchByTextQuery(BaseModel):
         asyncio.create_task(async_post_aiohttp(api_url, {"query": query}))
 
         # Create query embedding
-        query_embedding = product_search.co.embed(
-            texts=[query],
-            model=MODEL_NAME,
-            input_type='search_query'
-        ).embeddings[0]
+        product_search_client = await product_search.aget()
+        with tracing.span("search.embed"):
+            query_embedding = product_search_client.co.embed(
+                texts=[query],
+                model=MODEL_NAME,
+                input_type='search_query'
+            ).embeddings[0]
         
         # Prepare filter conditions
-        filt = await product_search.generate_filters_from_query(query)
+        with tracing.span("search.filters"):
+            filt = await product_search_client.generate_filters_from_query(query)
             
         # Query the index
-        results = product_search.index.query(
-            vector=query_embedding,
-            filter=filt,
-            top_k=top_k,
-            include_metadata=True
-        )
-        if len(results["matches"]) == 0:
-            results = product_search.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
+        results = query_index(product_search_client, query_embedding, filt)
         vision_model = cl.user_session.get("vision_model")
-        reranked_indices = await vision_model.rerank_products_against_query(
-            query=cl.user_session.get("latest_product_image"),
-            products=results["matches"]
+        reranked_indices = await rerank_with_fallback(
+            lambda: vision_model.rerank_products_against_query(query=query, products=results["matches"]),
+            num_products=len(results["matches"])
         )
         results["matches"] = [results["matches"][i - 1] for i in reranked_indices]
 
-        cl.user_session.set("latest_products", results["matches"])
+        products = set_latest_products(results["matches"])
 
         formatted_result = generate_product_recommendations_message(results)
-        await cl.CopilotFunction(
-            name="recommendations",
-            args={
-                "query": query,
-                "filters": filt,
-                "article_ids": formatted_result["article_ids"]
-            }
-        ).acall()
-        for message in formatted_result["messages"]:
-            await message.send()
-
-        display_results = str([match["metadata"] for match in results['matches']])
-        return f"Now showing recommendations for '{query}':\n{display_results}."
+        with tracing.span("chainlit.send", messages=len(formatted_result["messages"])):
+            await cl.CopilotFunction(
+                name="recommendations",
+                args={
+                    "query": query,
+                    "filters": filt,
+                    "article_ids": formatted_result["article_ids"]
+                }
+            ).acall()
+            for message in formatted_result["messages"]:
+                await message.send()
+        get_session_warmup().schedule(products, cl.user_session.get("id"))
+
+        return f"Now showing recommendations for '{query}':\n{format_products_for_model(products)}"
 
 
 class SearchByImageQuery(BaseModel):
@@ -111,45 +161,34 @@ class SearchByImageQuery(BaseModel):
             user_description_of_previous_recommendation
         """
         vision_model = cl.user_session.get("vision_model")
-        latest_products = cl.user_session.get("latest_products")
+        latest_products = get_latest_products()
         product_in_question_index = await vision_model.identify_previous_recommendation(
             description=description_of_previous_recommendation,
             products=latest_products
         )
         product_in_question = latest_products[product_in_question_index]
-        image = image_to_data_uri(product_in_question["metadata"]["image"])
-        # Create image embedding
-        print("Runing image embedding")
-        query_embedding = product_search.co.embed(
-            model=MODEL_NAME,
-            images=[image],
-            input_type='image'
-        ).embeddings[0]
-        print("Image embedding done")
-        
+        image = product_in_question["metadata"]["image"]
+        product_search_client = await product_search.aget()
+        # Image embeddings are computed offline, products added since then are embedded now
+        with tracing.span("search.embed", input="image") as span:
+            query_embedding = product_search_client.fetch_image_embedding(product_in_question["metadata"]["article_id"])
+            span.set(precomputed=query_embedding is not None)
+            if query_embedding is None:
+                query_embedding = product_search_client.embed_image(image)
+
         # Prepare filter conditions
-        filt = await product_search.generate_filters_from_query(image)
+        with tracing.span("search.filters", input="image"):
+            filt = await product_search_client.generate_filters_from_query(image, image_embedding=query_embedding)
 
         # Query the index
-        results = product_search.index.query(
-            vector=query_embedding,
-            filter=filt,
-            top_k=top_k,
-            include_metadata=True
-        )
-        if len(results["matches"]) == 0:
-            results = product_search.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
-        reranked_indices = await vision_model.rerank_products_against_image(
-            query_image=image,
-            products=results["matches"]
+        results = query_index(product_search_client, query_embedding, filt)
+        reranked_indices = await rerank_with_fallback(
+            lambda: vision_model.rerank_products_against_image(query_image=image, products=results["matches"]),
+            num_products=len(results["matches"])
         )
         results["matches"] = [results["matches"][i - 1] for i in reranked_indices]
 
-        cl.user_session.set("latest_products", results["matches"])
+        products = set_latest_products(results["matches"])
         
         formatted_result = generate_product_recommendations_message(results)
         asyncio.create_task(cl.CopilotFunction(
@@ -160,11 +199,12 @@ class SearchByImageQuery(BaseModel):
                 "article_ids": formatted_result["article_ids"]
             }
         ).acall())
-        for message in formatted_result["messages"]:
-            await message.send()
+        with tracing.span("chainlit.send", messages=len(formatted_result["messages"])):
+            for message in formatted_result["messages"]:
+                await message.send()
+        get_session_warmup().schedule(products, cl.user_session.get("id"))
 
-        display_results = str([match["metadata"] for match in results['matches']])
-        return f"Now showing similar recommendations:\n{display_results}."
+        return f"Now showing similar recommendations:\n{format_products_for_model(products)}"
 
 
 def generate_product_recommendations_message(results: dict):
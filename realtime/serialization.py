@@ -0,0 +1,52 @@
+import json
+import os
+from typing import Any, Callable, NamedTuple, Optional
+
+
+class Serializer(NamedTuple):
+    name: str
+    dumps: Callable[[Any], str]
+    loads: Callable[[Any], Any]
+
+
+def _orjson_serializer() -> Serializer:
+    import orjson
+
+    return Serializer("orjson", lambda obj: orjson.dumps(obj).decode("utf-8"), orjson.loads)
+
+
+def _msgspec_serializer() -> Serializer:
+    import msgspec
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    return Serializer("msgspec", lambda obj: encoder.encode(obj).decode("utf-8"), decoder.decode)
+
+
+def _json_serializer() -> Serializer:
+    return Serializer("json", json.dumps, json.loads)
+
+
+SERIALIZERS = {
+    "orjson": _orjson_serializer,
+    "msgspec": _msgspec_serializer,
+    "json": _json_serializer,
+}
+
+
+def get_serializer(name: Optional[str] = None) -> Serializer:
+    """
+    Get the JSON serializer for realtime events. Text frames are expected by the realtime API, so dumps returns str.
+
+    Args:
+        name: One of "orjson", "msgspec" or "json". Defaults to the REALTIME_JSON_BACKEND environment variable,
+            or the fastest installed backend.
+    """
+    name = name or os.getenv("REALTIME_JSON_BACKEND")
+    if name:
+        return SERIALIZERS[name]()
+    for factory in SERIALIZERS.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
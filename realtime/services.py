@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+from chainlit.logger import logger
+
+
+T = TypeVar("T")
+
+
+class LazyService(Generic[T]):
+    def __init__(self, name: str, factory: Callable[[], T]):
+        """
+        Handle to a client that is only created on first use, once even if first used from several threads.
+        A failed creation is retried on the next use.
+
+        Args:
+            name: Name of the service in the startup report
+            factory: Function creating the client, which may block on network calls
+        """
+        self.name = name
+        self.factory = factory
+        self.init_seconds: Optional[float] = None
+        self.error: Optional[Exception] = None
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> T:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    start = time.perf_counter()
+                    try:
+                        self._instance = self.factory()
+                    except Exception as e:
+                        self.error = e
+                        raise
+                    self.init_seconds = time.perf_counter() - start
+                    self.error = None
+        return self._instance
+
+    def set(self, instance: T) -> None:
+        """
+        Use the given client instead of creating one, e.g. a local stand-in in benchmarks.
+        """
+        with self._lock:
+            self._instance = instance
+            self.init_seconds = 0.0
+            self.error = None
+
+    async def aget(self) -> T:
+        """
+        Get the client, creating it in a thread so the event loop is not blocked.
+        """
+        if self._instance is not None:
+            return self._instance
+        return await asyncio.to_thread(self.get)
+
+
+services: Dict[str, LazyService] = {}
+_warmup_task: Optional[asyncio.Task] = None
+
+
+def register(name: str, factory: Callable[[], T]) -> LazyService[T]:
+    service = LazyService(name, factory)
+    services[name] = service
+    return service
+
+
+def warmup() -> asyncio.Task:
+    """
+    Start creating every registered service concurrently, once per process, and log the startup report when done.
+    """
+    global _warmup_task
+    if _warmup_task is None:
+        _warmup_task = asyncio.create_task(_warmup())
+    return _warmup_task
+
+
+async def _warmup() -> None:
+    start = time.perf_counter()
+    results = await asyncio.gather(*(service.aget() for service in services.values()), return_exceptions=True)
+    for service, result in zip(services.values(), results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to initialize {service.name}: {result}")
+    logger.info(startup_report(time.perf_counter() - start))
+
+
+def startup_report(total_seconds: Optional[float] = None) -> str:
+    lines = ["Service startup:"]
+    for service in services.values():
+        if service.initialized:
+            status = f"{service.init_seconds * 1000:.0f}ms"
+        elif service.error:
+            status = f"failed ({service.error})"
+        else:
+            status = "not initialized"
+        lines.append(f"  {service.name:<20}{status}")
+    if total_seconds is not None:
+        lines.append(f"  {'total':<20}{total_seconds * 1000:.0f}ms")
+    return "\n".join(lines)
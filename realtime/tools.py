@@ -1,8 +1,10 @@
 import asyncio
 import re
+from typing import ClassVar
 
 import chainlit as cl
 from pydantic import BaseModel
+from realtime.product_search.product_table import get_latest_products, product_table
 from realtime.product_search.tools import SearchByTextQuery, SearchByImageQuery
 from realtime.virtual_try_on import VirtualTryOn
 from realtime.vision import VisionModel
@@ -36,15 +38,16 @@ class AddToCart(BaseModel):
     or if the user mentions they want to add a product to the cart.
     """
     product_identifying_description: str
+    timeout_seconds: ClassVar[float] = 15
 
     @staticmethod
     async def handler(
         product_identifying_description: str,
     ) -> dict:
         if product_identifying_description == "after_try_on":
-            product = cl.user_session.get("latest_try_on_product")
+            product = product_table.get(cl.user_session.get("latest_try_on_product_id"))
         else:
-            latest_products = cl.user_session.get("latest_products")
+            latest_products = get_latest_products()
             index = await vision_model.identify_previous_recommendation(
                 description=product_identifying_description,
                 products=latest_products
@@ -64,3 +67,8 @@ class AddToCart(BaseModel):
 
 tool_models = [SearchByTextQuery, SearchByImageQuery, VirtualTryOn, AddToCart]
 tools = list(map(pydantic_to_tool_schema, tool_models))
+tool_timeouts = {
+    pascal_to_snake_case(model.__name__): model.timeout_seconds
+    for model in tool_models
+    if hasattr(model, "timeout_seconds")
+}
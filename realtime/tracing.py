@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, Optional
+from uuid import uuid4
+
+
+REALTIME_TRACE_FILE = os.getenv("REALTIME_TRACE_FILE")
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    start_time: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    duration_ms: Optional[float] = None
+    error: Optional[str] = None
+
+    def __post_init__(self):
+        self._start = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[str] = None) -> None:
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = self.elapsed_ms()
+        self.error = error or self.error
+        _sink.write(self)
+
+
+class _NoopSpan:
+    def set(self, **attributes) -> None:
+        pass
+
+    def end(self, error: Optional[str] = None) -> None:
+        pass
+
+
+class JsonlSink:
+    def __init__(self, path: str):
+        """
+        Appends finished spans to a file, one JSON object per line, as read by scripts/trace_summary.py: name,
+        trace_id, span_id, parent_span_id (null for a root span), start_time (Unix time in seconds), attributes,
+        duration_ms and error (null unless the span failed).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def write(self, span: Span) -> None:
+        line = json.dumps(asdict(span), default=str)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", buffering=1)
+            self._file.write(line + "\n")
+
+
+NOOP_SPAN = _NoopSpan()
+_sink = JsonlSink(REALTIME_TRACE_FILE) if REALTIME_TRACE_FILE else None
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def is_enabled() -> bool:
+    return _sink is not None
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """
+    Start a span, child of the current span, that is ended explicitly. Returns None when tracing is disabled.
+    """
+    if _sink is None:
+        return None
+    parent = _current_span.get()
+    return Span(
+        name=name,
+        trace_id=parent.trace_id if parent else uuid4().hex,
+        span_id=uuid4().hex[:16],
+        parent_span_id=parent.span_id if parent else None,
+        start_time=time.time(),
+        attributes=attributes,
+    )
+
+
+def set_current(span: Optional[Span]) -> None:
+    """
+    Make the span the parent of the spans started from now on in this context, and in tasks created from it.
+    """
+    if _sink is not None:
+        _current_span.set(span)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Any]:
+    """
+    Trace the enclosed block as a child of the current span. A no-op when REALTIME_TRACE_FILE is not set.
+    """
+    current = start_span(name, **attributes)
+    if current is None:
+        yield NOOP_SPAN
+        return
+    token = _current_span.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end(error)
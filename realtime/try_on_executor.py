@@ -0,0 +1,231 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import requests
+from chainlit.logger import logger
+
+from realtime.virtual_try_on_cache import RedisCache
+
+
+StatusCallback = Callable[[str], Awaitable[None]]
+
+# Status events emitted to listeners while a try-on is being produced
+STATUS_QUEUED = "queued"
+STATUS_CACHE_HIT = "cache_hit"
+STATUS_GENERATING = "generating"
+STATUS_RETRYING = "retrying"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TryOnError(Exception):
+    pass
+
+
+@dataclass
+class _Flight:
+    """A single in-flight try-on generation shared by every caller asking for the same cache key."""
+    task: Optional[asyncio.Task] = None
+    listeners: List[StatusCallback] = field(default_factory=list)
+    waiters: int = 0
+    background: bool = False
+    promoted: asyncio.Event = field(default_factory=asyncio.Event)
+    # Finish and cache the generation even once every caller is cancelled, set as well once the API is called
+    finish_on_cancel: bool = False
+
+    async def notify(self, status: str) -> None:
+        for listener in list(self.listeners):
+            try:
+                await listener(status)
+            except Exception:
+                logger.exception("Try-on status listener failed")
+
+
+class TryOnExecutor:
+    def __init__(
+        self,
+        cache: RedisCache,
+        max_concurrency: int = 2,
+        timeout_seconds: float = 120,
+        max_retries: int = 2,
+        backoff_seconds: float = 2.0,
+        max_background_concurrency: int = 1,
+    ):
+        """
+        Run virtual try-on requests off the event loop.
+
+        Identical requests that are already in flight are de-duplicated so the paid API is only called once,
+        and the number of concurrent API calls is bounded across all sessions.
+
+        Args:
+            cache: Redis cache used to store generated images
+            max_concurrency: Maximum number of concurrent calls to the try-on API
+            timeout_seconds: Timeout for a single call to the try-on API
+            max_retries: Number of retries for timeouts and retryable HTTP errors
+            backoff_seconds: Base delay for exponential backoff between retries
+            max_background_concurrency: Maximum number of concurrent low-priority (speculative) API calls
+        """
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._background_semaphore = asyncio.Semaphore(max_background_concurrency)
+        self._in_flight: Dict[str, _Flight] = {}
+        self.stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "deduplicated": 0,
+            "api_calls": 0,
+            "retries": 0,
+            "failures": 0,
+        }
+
+    def in_flight_count(self) -> int:
+        return len(self._in_flight)
+
+    def _on_flight_done(self, cache_key: str, flight: _Flight, task: asyncio.Task) -> None:
+        if self._in_flight.get(cache_key) is flight:
+            del self._in_flight[cache_key]
+        # Retrieve the error of a generation finished after its callers were cancelled, as it is already logged
+        if not task.cancelled():
+            task.exception()
+
+    async def run(
+        self,
+        url: str,
+        json: Dict[str, Any],
+        headers: Dict[str, str],
+        on_status: Optional[StatusCallback] = None,
+        background: bool = False,
+        cache_namespace: str = "",
+        finish_on_cancel: bool = False,
+    ) -> bytes:
+        """
+        Get the try-on image for the request, from the cache, an identical in-flight request, or the API.
+
+        Cancelling a caller only cancels the underlying request once no other caller is waiting on it, and only while
+        it is queued: once the paid API call has started, or if a caller asked for it to finish on cancel, it is still
+        generated and cached for the next request.
+        Background requests only use the background slots, unless a foreground caller joins them while they are
+        still waiting for one. The cache namespace separates requests that differ only in fields excluded from the
+        cache key, such as the model image.
+        """
+        self.stats["requests"] += 1
+        cache_key = self.cache._generate_cache_key(json, headers, cache_namespace)
+
+        flight = self._in_flight.get(cache_key)
+        if flight is None:
+            flight = _Flight(background=background)
+            self._in_flight[cache_key] = flight
+            flight.task = asyncio.create_task(self._execute(cache_key, url, json, headers, flight))
+            flight.task.add_done_callback(lambda task: self._on_flight_done(cache_key, flight, task))
+        else:
+            self.stats["deduplicated"] += 1
+        if not background:
+            flight.promoted.set()
+        flight.finish_on_cancel |= finish_on_cancel
+
+        if on_status:
+            flight.listeners.append(on_status)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done() and not flight.finish_on_cancel:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+            if on_status in flight.listeners:
+                flight.listeners.remove(on_status)
+
+    async def _execute(
+        self,
+        cache_key: str,
+        url: str,
+        json: Dict[str, Any],
+        headers: Dict[str, str],
+        flight: _Flight,
+    ) -> bytes:
+        cached_response = await asyncio.to_thread(self.cache.get_cached_response, cache_key)
+        if cached_response is not None:
+            self.stats["cache_hits"] += 1
+            await flight.notify(STATUS_CACHE_HIT)
+            return cached_response
+
+        await flight.notify(STATUS_QUEUED)
+        holds_background_slot = flight.background and await self._acquire_background_slot(flight)
+        try:
+            async with self._semaphore:
+                # The API call runs in a thread that can not be stopped, and is paid for either way
+                flight.finish_on_cancel = True
+                content = await self._post_with_retries(url, json, headers, flight)
+        except Exception:
+            self.stats["failures"] += 1
+            await flight.notify(STATUS_FAILED)
+            raise
+        finally:
+            if holds_background_slot:
+                self._background_semaphore.release()
+
+        await asyncio.to_thread(self.cache.cache_response, cache_key, content)
+        await flight.notify(STATUS_DONE)
+        return content
+
+    async def _acquire_background_slot(self, flight: _Flight) -> bool:
+        """
+        Wait for a background slot, returning False instead if the flight gets promoted to the foreground first.
+        """
+        if flight.promoted.is_set():
+            return False
+        acquire = asyncio.ensure_future(self._background_semaphore.acquire())
+        promoted = asyncio.ensure_future(flight.promoted.wait())
+        try:
+            await asyncio.wait({acquire, promoted}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            if acquire.done() and not acquire.cancelled():
+                self._background_semaphore.release()
+            raise
+        finally:
+            promoted.cancel()
+            if not acquire.done():
+                acquire.cancel()
+        return acquire.done() and not acquire.cancelled()
+
+    async def _post_with_retries(
+        self,
+        url: str,
+        json: Dict[str, Any],
+        headers: Dict[str, str],
+        flight: _Flight,
+    ) -> bytes:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                await flight.notify(STATUS_RETRYING)
+                await asyncio.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+            else:
+                await flight.notify(STATUS_GENERATING)
+
+            self.stats["api_calls"] += 1
+            try:
+                response = await asyncio.to_thread(
+                    requests.post, url, json=json, headers=headers, timeout=self.timeout_seconds
+                )
+            except requests.RequestException as e:
+                logger.warning(f"Try-on request failed (attempt {attempt + 1}): {e}")
+                error = TryOnError(f"Try-on request failed: {e}")
+                continue
+
+            if response.status_code == 200:
+                return response.content
+            error = TryOnError(f"Try-on request failed with status {response.status_code}: {response.text[:200]}")
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                raise error
+            logger.warning(f"Try-on request got status {response.status_code} (attempt {attempt + 1})")
+        raise error
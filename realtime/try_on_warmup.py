@@ -0,0 +1,87 @@
+import asyncio
+import os
+from typing import List, Optional
+
+import chainlit as cl
+from chainlit.logger import logger
+
+from realtime.model_images import model_images
+from realtime.try_on_executor import TryOnExecutor
+from realtime.virtual_try_on import (
+    SEGMIND_API_BASE,
+    build_try_on_request,
+    infer_try_on_category,
+    try_on_executor,
+)
+
+
+TRY_ON_WARMUP_TOP_N = int(os.getenv("TRY_ON_WARMUP_TOP_N", 2))
+TRY_ON_WARMUP_BUDGET = int(os.getenv("TRY_ON_WARMUP_BUDGET", 6))
+
+
+class TryOnWarmup:
+    def __init__(self, executor: TryOnExecutor, top_n: int = TRY_ON_WARMUP_TOP_N, budget: int = TRY_ON_WARMUP_BUDGET):
+        """
+        Speculatively pre-generate try-ons of the top recommendations into the try-on cache, so a subsequent
+        virtual try-on is a cache hit.
+
+        Args:
+            executor: Try-on executor the warmups are run on as background requests
+            top_n: Number of top recommendations to pre-generate after each search
+            budget: Maximum number of warmups for the session, since each one may be a paid API call
+        """
+        self.executor = executor
+        self.top_n = top_n
+        self.remaining_budget = budget
+        self.tasks: List[asyncio.Task] = []
+
+    def schedule(self, products: List[dict], user_id: Optional[str] = None) -> None:
+        """
+        Cancel any pending warmups and schedule warmups of the user's model image for the top products that
+        can be tried on.
+        """
+        self.cancel()
+        for product in products[:self.top_n]:
+            if self.remaining_budget <= 0:
+                break
+            category = infer_try_on_category(product["metadata"])
+            if category is None:
+                continue
+            self.remaining_budget -= 1
+            self.tasks.append(asyncio.create_task(self._warm(product, category, user_id)))
+
+    def cancel(self) -> None:
+        """
+        Cancel the warmups still waiting for the try-on API. Those already calling it finish, and are cached.
+        """
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def _warm(self, product: dict, category: str, user_id: Optional[str]) -> None:
+        try:
+            model_image = await asyncio.to_thread(model_images.get, user_id)
+            data, headers = await asyncio.to_thread(build_try_on_request, product, category, model_image)
+            await self.executor.run(
+                SEGMIND_API_BASE,
+                json=data,
+                headers=headers,
+                background=True,
+                cache_namespace=model_image.digest,
+            )
+            logger.info(f"Warmed up try-on of {product['metadata']['article_id']}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Try-on warmup of {product['metadata']['article_id']} failed: {e}")
+
+
+def get_session_warmup() -> TryOnWarmup:
+    """
+    Get the try-on warmup of the current user session.
+    """
+    warmup = cl.user_session.get("try_on_warmup")
+    if warmup is None:
+        warmup = TryOnWarmup(try_on_executor)
+        cl.user_session.set("try_on_warmup", warmup)
+    return warmup
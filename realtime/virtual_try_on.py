@@ -1,38 +1,99 @@
 import asyncio
 import os
 from enum import Enum
+from functools import lru_cache
+from typing import ClassVar, Dict, Optional, Tuple
 
 import chainlit as cl
 from io import BytesIO
 from PIL import Image
+from realtime import tracing
+from realtime.model_images import ModelImage, model_images
+from realtime.product_search.product_table import get_latest_products
+from realtime.try_on_executor import TryOnExecutor
 from realtime.virtual_try_on_cache import RedisCache
 from realtime.vision import VisionModel, image_to_data_uri
 from pydantic import BaseModel
 
 
-MODEL_IMAGE_PATH = "static/images/patrick_model.jpg"
 SEGMIND_API_KEY = os.getenv("SEGMIND_API_KEY")
-SEGMIND_API_BASE = "https://api.segmind.com/v1/virtual-try-on"
+SEGMIND_API_BASE = os.getenv("SEGMIND_API_BASE", "https://api.segmind.com/v1/virtual-try-on")
 num_inference_steps: int = 30
 guidance_scale: int = 2
 seed: int = 0
 base64: bool = False
 redis_cache = RedisCache()
+try_on_executor = TryOnExecutor(
+    redis_cache,
+    max_concurrency=int(os.getenv("TRY_ON_MAX_CONCURRENCY", 2)),
+    timeout_seconds=float(os.getenv("TRY_ON_TIMEOUT_SECONDS", 120)),
+)
 vision_model = VisionModel(model_name=os.getenv("OPENAI_VISION_MODEL"))
 
 
+TRY_ON_STATUS_MESSAGES = {
+    "queued": "Waiting for a free fitting room for {prod_name}...",
+    "cache_hit": "Found a previous try-on of {prod_name}!",
+    "generating": "Generating virtual try-on of {prod_name}...",
+    "retrying": "Still working on {prod_name}, retrying the try-on...",
+    "done": "Virtual try-on of {prod_name} is ready!",
+    "failed": "Sorry, the virtual try-on of {prod_name} failed.",
+}
+
+
 class ClothingCategory(str, Enum):
     UPPER_BODY = "Upper body"
     LOWER_BODY = "Lower body"
     DRESS = "Dress"
 
 
+PRODUCT_GROUP_CATEGORIES = {
+    "Garment Upper body": ClothingCategory.UPPER_BODY,
+    "Garment Lower body": ClothingCategory.LOWER_BODY,
+    "Garment Full body": ClothingCategory.DRESS,
+}
+
+
+def infer_try_on_category(metadata: dict) -> Optional[ClothingCategory]:
+    """
+    Infer the try-on category of a product from its product group, if it can be tried on.
+    """
+    return PRODUCT_GROUP_CATEGORIES.get(metadata.get("product_group_name"))
+
+
+@lru_cache(maxsize=64)
+def encode_cloth_image(path: str) -> str:
+    return image_to_data_uri(path).split(",")[1]
+
+
+def build_try_on_request(product: dict, category: str, model_image: ModelImage) -> Tuple[Dict, Dict]:
+    """
+    Build the try-on API payload and headers for a product.
+    Warmups and user-requested try-ons must build identical payloads to share cache entries.
+    """
+    data = {
+        "model_image": model_image.base64,
+        "cloth_image": encode_cloth_image(product["metadata"]["image"]),
+        "category": ClothingCategory(category).value,
+        "num_inference_steps": num_inference_steps,
+        "guidance_scale": guidance_scale,
+        "base64": base64
+    }
+    if seed is not None:
+        data["seed"] = seed
+    headers = {'x-api-key': SEGMIND_API_KEY}
+    return data, headers
+
+
 def resize_to_orig_size(image: bytes, size: tuple) -> bytes:
     """
     Resize an image to its original size.
+    Returns the image untouched if it already is a JPEG of that size, since opening only reads the header.
     """
     img = Image.open(BytesIO(image))
-    img = img.resize(size)
+    if img.size == tuple(size) and img.format == "JPEG":
+        return image
+    img = img.convert("RGB").resize(size)
 
     buffer = BytesIO()
     img.save(buffer, "JPEG")
@@ -49,6 +110,8 @@ class VirtualTryOn(BaseModel):
     """
     description_of_previous_recommendation: str
     category: ClothingCategory
+    # Covers every attempt the executor makes, plus the wait behind other try-ons
+    timeout_seconds: ClassVar[float] = try_on_executor.timeout_seconds * (try_on_executor.max_retries + 1) + 30
 
     @staticmethod
     async def handler(
@@ -57,13 +120,13 @@ class VirtualTryOn(BaseModel):
     ) -> dict:
 
         print('trying on')
-        latest_products = cl.user_session.get("latest_products")
+        latest_products = get_latest_products()
         index = await vision_model.identify_previous_recommendation(
             description=description_of_previous_recommendation,
             products=latest_products
         )
         product = latest_products[index]
-        cl.user_session.set("latest_try_on_product", product)
+        cl.user_session.set("latest_try_on_product_id", product["id"])
         print('sending try on task')
         await cl.CopilotFunction(
             name="try_on",
@@ -71,33 +134,41 @@ class VirtualTryOn(BaseModel):
         ).acall()
         print('sent try on task.')
 
-        cloth_image = product["metadata"]["image"]
-
-        model_image = image_to_data_uri(MODEL_IMAGE_PATH).split(",")[1]
-
-        data = {
-            "model_image": model_image,
-            "cloth_image": image_to_data_uri(cloth_image).split(",")[1],
-            "category": category,
-            "num_inference_steps": num_inference_steps,
-            "guidance_scale": guidance_scale,
-            "base64": base64
-        }
-        if seed is not None:
-            data["seed"] = seed
-        headers = {'x-api-key': SEGMIND_API_KEY}
+        # Prefer the catalog's category so the request matches the one pre-generated by the warmup
+        category = infer_try_on_category(product["metadata"]) or category
+        model_image = await asyncio.to_thread(model_images.get, cl.user_session.get("id"))
+        data, headers = build_try_on_request(product, category, model_image)
+        status_message = cl.Message(content=TRY_ON_STATUS_MESSAGES["queued"].format(**product["metadata"]))
+        await status_message.send()
+
+        async def on_status(status: str):
+            status_message.content = TRY_ON_STATUS_MESSAGES[status].format(**product["metadata"])
+            await status_message.update()
+
         print("Running try on")
-        response = redis_cache.make_cached_request(SEGMIND_API_BASE, json=data, headers=headers)
+        with tracing.span("try_on.generate"):
+            content = await try_on_executor.run(
+                SEGMIND_API_BASE,
+                json=data,
+                headers=headers,
+                on_status=on_status,
+                cache_namespace=model_image.digest,
+                # The user is invited to keep talking, which cancels this call: the next request gets the result
+                finish_on_cancel=True,
+            )
         print("Got response")
 
+        with tracing.span("try_on.resize"):
+            resized = await asyncio.to_thread(resize_to_orig_size, content, model_image.size)
         elements = [
             cl.Image(
                 name=f'Virtual Try On {product["metadata"]["prod_name"]}',
-                content=resize_to_orig_size(response.content, (1191, 2014)),
+                content=resized,
                 display="inline",
                 size="large",
             )
         ]
-        await cl.Message(content=f"Virtual Try On {product['metadata']['prod_name']}", elements=elements).send()
+        with tracing.span("chainlit.send", messages=1):
+            await cl.Message(content=f"Virtual Try On {product['metadata']['prod_name']}", elements=elements).send()
 
         return "Virtual Try-On completed successfully! Tell the user how good they look as if you can see the picture, being as specific as possible! Then, ask if they would like to buy the product."
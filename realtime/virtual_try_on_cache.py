@@ -6,13 +6,15 @@ from typing import Dict, Any, Optional
 import os
 import zlib
 
-REDIS_URL = "redis-11713.c60.us-west-1-2.ec2.redns.redis-cloud.com"
+REDIS_URL = os.getenv("REDIS_HOST", "redis-11713.c60.us-west-1-2.ec2.redns.redis-cloud.com")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 11713))
 
 
 class RedisCache:
     def __init__(
         self,
         redis_url: str = REDIS_URL,
+        redis_port: int = REDIS_PORT,
         ttl_seconds: int = 3600 * 24,
         prefix: str = "api_cache:",
         compression_threshold: int = 1000000000,  # Compress responses larger than 1KB
@@ -23,6 +25,7 @@ class RedisCache:
         
         Args:
             redis_url: Redis connection URL from Redis Cloud
+            redis_port: Redis port
             ttl_seconds: Cache TTL in seconds
             prefix: Key prefix for cache entries
             compression_threshold: Compress items larger than this (bytes)
@@ -31,7 +34,7 @@ class RedisCache:
         # Use a single connection pool to stay within connection limits
         self.redis_client = redis.Redis(
             host=redis_url,
-            port=11713,
+            port=redis_port,
             username=os.getenv("REDIS_USERNAME"),
             password=os.getenv("REDIS_PASSWORD"),
             decode_responses=False,  # Need binary for compression
@@ -42,7 +45,7 @@ class RedisCache:
         self.compression_threshold = compression_threshold
         self.max_item_size = max_item_size
 
-    def _generate_cache_key(self, data: Dict[str, Any], headers: Dict[str, str]) -> str:
+    def _generate_cache_key(self, data: Dict[str, Any], headers: Dict[str, str], namespace: str = "") -> str:
         """Generate a compact cache key."""
         headers_copy = headers.copy()
         headers_copy.pop('x-api-key', None)
@@ -52,6 +55,9 @@ class RedisCache:
             'data': {k: v for k, v in data.items() if k not in ['model_image', 'base64']},
             'headers': headers_copy
         }
+        if namespace:
+            # Stands in for the excluded fields, i.e. a digest of the model image
+            cache_data['namespace'] = namespace
         return f"{self.prefix}{hashlib.md5(dumps(cache_data, sort_keys=True).encode()).hexdigest()}"
 
     def _compress_data(self, data: bytes) -> bytes:
@@ -189,7 +195,8 @@ class RedisCache:
 
 if __name__ == '__main__':
     from realtime.vision import image_to_data_uri
-    from realtime.virtual_try_on import MODEL_IMAGE_PATH, SEGMIND_API_BASE
+    from realtime.model_images import MODEL_IMAGE_PATH
+    from realtime.virtual_try_on import SEGMIND_API_BASE
 
     cloth_image = "data/product_catalog_images/0108775015.jpg"
     category = "Upper body"
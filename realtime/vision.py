@@ -1,17 +1,29 @@
 import base64
+import importlib
 import json
 import os
 import re
+from functools import lru_cache
 from inspect import cleandoc
 from mimetypes import guess_type
 
 from PIL import Image
 from dotenv import load_dotenv
-from litellm import acompletion
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+
+from realtime import services, tracing
+from realtime.llm_cache import CompletionCache, completion_cache
+from realtime.product_search.references import resolve_product_reference
 
 load_dotenv(override=True)
 
+# Importing litellm takes about a second, so it is imported in a thread on first use or by the startup warmup
+litellm_module = services.register("litellm", lambda: importlib.import_module("litellm"))
+
+
+async def acompletion(**kwargs):
+    return await (await litellm_module.aget()).acompletion(**kwargs)
+
 
 VISION_SYSTEM_PROMPT = cleandoc("""
 You are a helpful concise but comprehensive AI shopping assistant for the HM store with vision capabilities, serving as the eyes for a blind user.
@@ -38,7 +50,10 @@ is "colour_group", return [].
 """).strip()
 IDENTIFY_PREVIOUS_RECOMMENDATION_PROMPT = cleandoc("""
 Identify the index of the previous product recommendation that the user is referencing based on the description provided and the products listed.
-The user may reference the location of the product in the UI, here is the translation guide.
+The user may reference the location of the product in the UI, here is the translation guide:
+- The products are shown one below the other, in the order listed.
+- The first or top product is index 0, the second one is index 1, and so on.
+- The last or bottom product is index {last_index}.
 Your response should simply be the integer index of the product referenced.
 """).strip()
 
@@ -47,6 +62,22 @@ class RerankResults(BaseModel):
     indices: list[int]
 
 
+def parse_rerank_indices(content: str, num_products: int) -> list[int]:
+    """
+    Parse the reranker output into unique 1-based indices of the products, in order of relevance.
+    Out-of-range indices are dropped. Raises ValueError if the output is not a list of indices.
+    """
+    try:
+        indices = RerankResults.model_validate_json(content).indices
+    except ValidationError:
+        # Some models answer with the bare list, i.e. [3, 1, 2]
+        try:
+            indices = RerankResults(indices=json.loads(content)).indices
+        except (ValueError, ValidationError) as e:
+            raise ValueError(f"Invalid rerank output: {content!r}") from e
+    return list(dict.fromkeys(i for i in indices if 1 <= i <= num_products))
+
+
 class MetadataFilterResults(BaseModel):
     filter_values: list[str]
 
@@ -81,22 +112,40 @@ def image_to_data_uri(image: str) -> str:
     elif image.startswith("http"):
         return image
     else:
-        mime = guess_type(image)[0]
-        with open(image, "rb") as image_file:
-            return f"data:{mime};base64," + base64.b64encode(image_file.read()).decode("utf-8")
+        return _file_to_data_uri(image)
+
+
+@lru_cache(maxsize=128)
+def _file_to_data_uri(path: str) -> str:
+    mime = guess_type(path)[0]
+    with open(path, "rb") as image_file:
+        return f"data:{mime};base64," + base64.b64encode(image_file.read()).decode("utf-8")
 
 
 class VisionModel:
-    def __init__(self, model_name: str = None):
+    def __init__(self, model_name: str = None, cache: CompletionCache = completion_cache):
         self.client = acompletion
         self.model_name = model_name or os.getenv("OPENAI_VISION_MODEL")
+        self.cache = cache
+
+    async def _complete(self, cached: bool = True, **kwargs):
+        """
+        Call the vision model, serving deterministic (temperature 0) calls from the shared completion cache unless
+        cached is False.
+        """
+        with tracing.span("llm.complete", model=self.model_name):
+            if not cached or self.cache is None or kwargs.get("temperature") != 0:
+                return await self.client(model=self.model_name, **kwargs)
+            key = self.cache.make_key(model=self.model_name, **kwargs)
+            return await self.cache.get_or_create(key, lambda: self.client(model=self.model_name, **kwargs))
 
-    async def generate_image_description(self, image: Image.Image):
+    async def generate_image_description(self, image: Image.Image, cached: bool = True):
         """
-        Generate a description of the image provided by the user.
+        Generate a description of the image provided by the user, without the completion cache if cached is False,
+        i.e. for callers caching descriptions themselves.
         """
-        result = await acompletion(
-            model=self.model_name,
+        result = await self._complete(
+            cached=cached,
             temperature=0,
             messages=[
                 {
@@ -125,8 +174,7 @@ class VisionModel:
         """
         Rerank products against the given query.
         """
-        result = await acompletion(
-            model=self.model_name,
+        result = await self._complete(
             temperature=0,
             messages=[
                 {
@@ -156,14 +204,13 @@ class VisionModel:
             safety_settings=SAFETY_SETTINGS,
             response_format=RerankResults
         )
-        return [int(i) for i in eval(result.choices[0].message.content)["indices"]]
+        return parse_rerank_indices(result.choices[0].message.content, len(products))
 
     async def rerank_products_against_image(self, query_image: str, products: list[dict]):
         """
         Rerank products against the given query image.
         """
-        result = await acompletion(
-            model=self.model_name,
+        result = await self._complete(
             temperature=0,
             messages=[
                 {
@@ -197,20 +244,25 @@ class VisionModel:
             safety_settings=SAFETY_SETTINGS,
             response_format=RerankResults
         )
-        return [int(i) for i in eval(result.choices[0].message.content)["indices"]]
+        return parse_rerank_indices(result.choices[0].message.content, len(products))
     
     async def identify_previous_recommendation(self, description: str, products: list[dict]):
         """
         Identify the index of the previous product recommendation that the user is referencing based on the description provided and the 4 products listed.
+        Positions, names and colours are resolved locally; the model is only asked about ambiguous references.
         """
-        result = await acompletion(
-            model=self.model_name,
+        with tracing.span("identify.local") as span:
+            index = resolve_product_reference(description, products)
+            span.set(resolved=index is not None)
+        if index is not None:
+            return index
+        result = await self._complete(
             temperature=0,
             max_completion_tokens=10,
             messages=[
                 {
                     "role": "system",
-                    "content": IDENTIFY_PREVIOUS_RECOMMENDATION_PROMPT.format(num_products=str(len(products)))
+                    "content": IDENTIFY_PREVIOUS_RECOMMENDATION_PROMPT.format(last_index=len(products) - 1)
                 },
                 {
                     "role": "user",
@@ -222,7 +274,7 @@ class VisionModel:
                     ] + [
                         {
                             "type": "text",
-                            "text": f"{i}. {product['metadata']['prod_name']} ({product['metadata']['colour_group_name']}"
+                            "text": f"{i}. {product['metadata']['prod_name']} ({product['metadata']['colour_group_name']})"
                         } if is_prod else {
                             "type": "image_url",
                             "image_url": {"url": image_to_data_uri(product["metadata"]["image"])}
@@ -235,16 +287,16 @@ class VisionModel:
             safety_settings=SAFETY_SETTINGS
         )
         try:
-            return int(re.findall(r'\d', result.choices[0].message.content)[0])
+            index = int(re.findall(r'\d+', result.choices[0].message.content)[0])
         except Exception:
             return 0
+        return index if 0 <= index < len(products) else 0
         
     async def filter_metadata_filter(self, query: str, filter_category: str, filter_values: list[str]):
         """
         Filter metadata filter values based on the query.
         """
-        result = await acompletion(
-            model=self.model_name,
+        result = await self._complete(
             temperature=0,
             messages=[
                 {
@@ -0,0 +1,99 @@
+"""
+Microbenchmark of the realtime websocket hot path: events/s per core for each installed JSON backend.
+
+Measures raw decoding of server events and encoding of client audio events, and the full RealtimeAPI receive
+and send paths (decode/encode, debug logging and dispatch):
+    python scripts/benchmark_realtime_serialization.py --duration 1
+"""
+import argparse
+import asyncio
+import base64
+import os
+import time
+
+from realtime import RealtimeAPI
+from realtime.serialization import SERIALIZERS, get_serializer
+
+
+AUDIO_CHUNK_BYTES = 4800  # 100ms of 24kHz PCM16
+
+
+def make_events() -> dict:
+    audio = base64.b64encode(os.urandom(AUDIO_CHUNK_BYTES)).decode("utf-8")
+    return {
+        "server": [
+            {
+                "event_id": "event_1", "type": "response.audio.delta", "response_id": "resp_1", "item_id": "item_1",
+                "output_index": 0, "content_index": 0, "delta": audio,
+            },
+            {
+                "event_id": "event_2", "type": "response.audio_transcript.delta", "response_id": "resp_1",
+                "item_id": "item_1", "output_index": 0, "content_index": 0, "delta": "Happy birthday, ",
+            },
+        ],
+        "client": {"type": "input_audio_buffer.append", "audio": audio},
+    }
+
+
+class NullWebsocket:
+    async def send(self, message):
+        pass
+
+
+def measure(fn, duration: float) -> float:
+    """
+    Call fn repeatedly for about the given duration of CPU time, returning the calls per CPU second.
+    """
+    calls = 0
+    start = time.process_time()
+    while (elapsed := time.process_time() - start) < duration:
+        for _ in range(100):
+            fn()
+        calls += 100
+    return calls / elapsed
+
+
+def benchmark_backend(name: str, events: dict, duration: float) -> dict:
+    serializer = get_serializer(name)
+    server_messages = [serializer.dumps(event) for event in events["server"]]
+    client_event = events["client"]
+    loop = asyncio.new_event_loop()
+
+    api = RealtimeAPI(api_key="benchmark", serializer=serializer)
+    api.ws = NullWebsocket()
+
+    def receive():
+        for message in server_messages:
+            api._handle_message(message)
+
+    def send():
+        loop.run_until_complete(api.send(client_event["type"], {"audio": client_event["audio"]}))
+
+    results = {
+        "decode": measure(lambda: [serializer.loads(message) for message in server_messages], duration)
+        * len(server_messages),
+        "encode": measure(lambda: serializer.dumps(client_event), duration),
+        "receive path": measure(receive, duration) * len(server_messages),
+        "send path": measure(send, duration),
+    }
+    loop.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=1.0, help="CPU seconds per measurement")
+    args = parser.parse_args()
+
+    events = make_events()
+    print(f"{'backend':<10}{'decode':>14}{'encode':>14}{'receive path':>16}{'send path':>14}  (events/s per core)")
+    for name in SERIALIZERS:
+        try:
+            results = benchmark_backend(name, events, args.duration)
+        except ImportError:
+            print(f"{name:<10}  not installed")
+            continue
+        print(
+            f"{name:<10}{results['decode']:>14,.0f}{results['encode']:>14,.0f}"
+            f"{results['receive path']:>16,.0f}{results['send path']:>14,.0f}"
+        )
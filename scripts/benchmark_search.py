@@ -0,0 +1,434 @@
+"""
+Offline benchmark of the product search path: SearchByTextQuery.handler and SearchByImageQuery.handler run end to
+end against local stand-ins, i.e. a deterministic fake embedder instead of Cohere, an in-memory index instead of
+Pinecone, synthesized LLM responses and fake Chainlit sessions.
+
+Reports throughput, per-stage latency from the tracing spans and, with --allocations, memory allocated per search:
+    python scripts/benchmark_search.py --products 2000 --sessions 4 --repeat 3 --allocations
+
+LLM responses are synthesized: every product is kept in order and every metadata value is kept, so only the cost
+of the search itself is measured. With --fixtures, responses recorded in that file are replayed instead, keyed like
+the completion cache, and with --record the missing ones are requested from OPENAI_VISION_MODEL and saved to it.
+"""
+import argparse
+import ast
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from types import SimpleNamespace
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from trace_summary import load_durations, percentile
+
+
+EMBEDDING_DIMENSION = 384
+DEFAULT_QUERIES = [
+    "red summer dress",
+    "black jeans for men",
+    "warm knitted sweater",
+    "white sneakers",
+    "blue denim jacket on sale",
+    "floral blouse",
+    "kids pyjamas",
+    "striped t-shirt",
+    "beige trench coat",
+    "green hoodie",
+    "swimwear",
+    "formal trousers",
+]
+COLOURS = ["Black", "White", "Red", "Blue", "Dark Blue", "Green", "Beige", "Pink", "Grey", "Yellow"]
+PRODUCT_TYPES = [
+    ("Dress", "Garment Full body"),
+    ("Trousers", "Garment Lower body"),
+    ("Shorts", "Garment Lower body"),
+    ("Sweater", "Garment Upper body"),
+    ("T-shirt", "Garment Upper body"),
+    ("Blouse", "Garment Upper body"),
+    ("Jacket", "Garment Upper body"),
+    ("Sneakers", "Shoes"),
+]
+INDEX_NAMES = ["Ladieswear", "Menswear", "Divided", "Children Sizes 92-140", "Sport"]
+SECTION_NAMES = ["Womens Everyday Collection", "Mens Casual", "Divided Basics", "Kids Boy", "Ladies Denim"]
+
+
+class FakeEmbedder:
+    """Deterministic stand-in for the Cohere client: texts embed as the normalized sum of per-word random vectors."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._word_vectors = {}
+
+    def _vector(self, seed_text: str) -> np.ndarray:
+        vector = self._word_vectors.get(seed_text)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(seed_text.encode("utf-8")))
+            vector = self._word_vectors[seed_text] = rng.standard_normal(EMBEDDING_DIMENSION).astype(np.float32)
+        return vector
+
+    def embed_text(self, text: str) -> np.ndarray:
+        words = re.findall(r"\w+", text.lower()) or [""]
+        vector = np.sum([self._vector(word) for word in words], axis=0)
+        return vector / np.linalg.norm(vector)
+
+    def embed_image(self, data_uri: str) -> np.ndarray:
+        return self._vector(f"image:{zlib.crc32(data_uri.encode('utf-8'))}")
+
+    def embed(self, texts=None, images=None, model=None, input_type=None):
+        if self.latency:
+            time.sleep(self.latency)
+        if images is not None:
+            embeddings = [self.embed_image(image).tolist() for image in images]
+        else:
+            embeddings = [self.embed_text(text).tolist() for text in texts]
+        return SimpleNamespace(embeddings=embeddings)
+
+
+class LocalMatch(dict):
+    """Match supporting both the item and attribute access of Pinecone's query responses."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class LocalIndex:
+    """
+    In-memory stand-in for a Pinecone index: brute-force cosine similarity with Pinecone's filter operators over
+    the default namespace, and fetches by id from the other namespaces.
+    """
+
+    def __init__(self, ids: list[str], vectors: np.ndarray, metadata: list[dict], latency: float = 0.0):
+        self.ids = ids
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.metadata = metadata
+        self.latency = latency
+        self.namespaces = {}
+
+    def describe_index_stats(self):
+        return {"total_vector_count": len(self.ids)}
+
+    @classmethod
+    def _matches(cls, metadata: dict, filter: dict) -> bool:
+        for key, condition in filter.items():
+            if key == "$and":
+                if not all(cls._matches(metadata, sub_filter) for sub_filter in condition):
+                    return False
+            elif "$eq" in condition:
+                if metadata.get(key) != condition["$eq"]:
+                    return False
+            elif "$in" in condition:
+                if metadata.get(key) not in condition["$in"]:
+                    return False
+        return True
+
+    def query(self, vector, top_k: int, filter: dict = None, include_metadata: bool = True):
+        if self.latency:
+            time.sleep(self.latency)
+        scores = self.vectors @ np.asarray(vector, dtype=np.float32)
+        if filter:
+            mask = np.array([self._matches(metadata, filter) for metadata in self.metadata], dtype=bool)
+            scores = np.where(mask, scores, -np.inf)
+        top = np.argsort(-scores)[:top_k]
+        matches = [
+            LocalMatch(id=self.ids[i], score=float(scores[i]), metadata=self.metadata[i])
+            for i in top
+            if np.isfinite(scores[i])
+        ]
+        return LocalMatch(matches=matches)
+
+    def upsert(self, vectors: list[tuple], namespace: str):
+        self.namespaces.setdefault(namespace, {}).update(
+            (vector_id, SimpleNamespace(id=vector_id, values=values, metadata=metadata))
+            for vector_id, values, metadata in vectors
+        )
+
+    def fetch(self, ids: list[str], namespace: str):
+        if self.latency:
+            time.sleep(self.latency)
+        stored = self.namespaces.get(namespace, {})
+        return SimpleNamespace(vectors={vector_id: stored[vector_id] for vector_id in ids if vector_id in stored})
+
+
+class SyntheticCompletion:
+    """
+    Stand-in for litellm's acompletion synthesizing responses, or replaying the ones recorded in a fixtures file,
+    keyed like the completion cache.
+    """
+
+    def __init__(self, fixtures_path: Optional[str] = None, record: bool = False, latency: float = 0.0):
+        from realtime.llm_cache import CompletionCache
+
+        self.make_key = CompletionCache.make_key
+        self.fixtures_path = fixtures_path
+        self.record = record
+        self.latency = latency
+        self.fixtures = {}
+        if fixtures_path and os.path.exists(fixtures_path):
+            with open(fixtures_path) as f:
+                self.fixtures = json.load(f)
+        self.stats = {"replayed": 0, "synthesized": 0, "recorded": 0}
+
+    async def __call__(self, **kwargs):
+        key = self.make_key(**kwargs)
+        content = self.fixtures.get(key)
+        if content is not None:
+            self.stats["replayed"] += 1
+        elif self.record:
+            from litellm import acompletion
+
+            content = (await acompletion(**kwargs)).choices[0].message.content
+            self.fixtures[key] = content
+            self.stats["recorded"] += 1
+        else:
+            content = self.synthesize(kwargs)
+            self.stats["synthesized"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    @staticmethod
+    def synthesize(kwargs: dict) -> str:
+        from realtime.vision import MetadataFilterResults, RerankResults
+
+        texts = [part["text"] for part in kwargs["messages"][-1]["content"] if part.get("type") == "text"]
+        if kwargs.get("response_format") is RerankResults:
+            # Each product is a text part starting with its 1-based number
+            num_products = sum(1 for text in texts if re.match(r"\d+\. ", text))
+            return json.dumps({"indices": list(range(1, num_products + 1))})
+        if kwargs.get("response_format") is MetadataFilterResults:
+            values = ast.literal_eval(" ".join(texts).split("Filter values: ", 1)[1])
+            return json.dumps({"filter_values": values})
+        return "0"
+
+    def save(self) -> None:
+        if os.path.dirname(self.fixtures_path):
+            os.makedirs(os.path.dirname(self.fixtures_path), exist_ok=True)
+        with open(self.fixtures_path, "w") as f:
+            json.dump(self.fixtures, f, indent=1, sort_keys=True)
+
+
+def create_catalog(num_products: int, images_dir: str) -> pd.DataFrame:
+    """
+    Create a synthetic catalog with the columns of data/product_catalog.csv and a small image per product.
+    """
+    rng = random.Random(0)
+    rows = []
+    for i in range(num_products):
+        product_type, product_group = rng.choice(PRODUCT_TYPES)
+        colour = rng.choice(COLOURS)
+        article_id = 100000000 + i
+        Image.new("RGB", (64, 96), tuple(rng.randrange(256) for _ in range(3))).save(
+            os.path.join(images_dir, f"0{article_id}.jpg"), "JPEG"
+        )
+        rows.append({
+            "article_id": article_id,
+            "prod_name": f"{colour} {product_type} {i}",
+            "detail_desc": f"A {colour.lower()} {product_type.lower()} in soft fabric.",
+            "colour_group_name": colour,
+            "product_type_name": product_type,
+            "product_group_name": product_group,
+            "index_name": rng.choice(INDEX_NAMES),
+            "section_name": rng.choice(SECTION_NAMES),
+            "on_sale": rng.choice(["Regular Price", "On Sale"]),
+        })
+    return pd.DataFrame(rows)
+
+
+def build_product_search(catalog: pd.DataFrame, images_dir: str, embedder: FakeEmbedder, index_latency: float):
+    """
+    Build a ProductSearch backed by local indexes, bypassing its constructor's Pinecone and Cohere clients, with the
+    image embeddings of the catalog precomputed.
+    """
+    from realtime.product_search.base import METADATA_COLUMNS, MetadataSearch, ProductSearch
+
+    records = catalog.to_dict("records")
+    product_search = ProductSearch.__new__(ProductSearch)
+    product_search.co = embedder
+    product_search.index = LocalIndex(
+        ids=[f"text_{row['article_id']}" for row in records],
+        vectors=np.stack([
+            embedder.embed_text(" ".join(str(row[column]) for column in ProductSearch.COLUMN_TITLES if column in row))
+            for row in records
+        ]),
+        metadata=[
+            {
+                **{key: str(value) for key, value in row.items()},
+                "image": os.path.join(images_dir, f"0{row['article_id']}.jpg"),
+                "embedding_type": "text",
+            }
+            for row in records
+        ],
+        latency=index_latency,
+    )
+    product_search.metadata_searchers = {}
+    for column in METADATA_COLUMNS:
+        counts = catalog[column].value_counts()
+        searcher = MetadataSearch.__new__(MetadataSearch)
+        searcher.column_name = column
+        searcher.co = embedder
+        searcher.index = LocalIndex(
+            ids=[f"metadata_{column}_{value}" for value in counts.index],
+            vectors=np.stack([embedder.embed_text(f"{column}: {value}") for value in counts.index]),
+            metadata=[
+                {"value": value, "column_name": column, "frequency": int(count), "embedding_type": "metadata"}
+                for value, count in counts.items()
+            ],
+            latency=index_latency,
+        )
+        searcher.index_size = len(counts)
+        product_search.metadata_searchers[column] = searcher
+    # Embedded offline, so without the simulated latency
+    product_search.co = FakeEmbedder()
+    product_search.add_image_embeddings(catalog, images_dir, requests_per_minute=0)
+    product_search.co = embedder
+    return product_search
+
+
+def use_local_search(catalog: pd.DataFrame, images_dir: str, embedder: FakeEmbedder, index_latency: float) -> None:
+    """
+    Make the search tools use a local ProductSearch and ProductCatalog over the catalog, without updating the
+    preferences service.
+    """
+    from realtime.product_search import tools as search_tools
+    from realtime.product_search.catalog import ProductCatalog, product_catalog
+
+    async def skip_preferences_update(url, data):
+        pass
+
+    search_tools.async_post_aiohttp = skip_preferences_update
+    search_tools.product_search.set(build_product_search(catalog, images_dir, embedder, index_latency))
+    product_catalog.set(ProductCatalog(catalog, images_dir))
+
+
+async def run_benchmark(args: argparse.Namespace, trace_file: str) -> None:
+    import chainlit as cl
+    from chainlit.context import init_http_context
+
+    from realtime.llm_cache import completion_cache
+    from realtime.product_search.tools import SearchByImageQuery, SearchByTextQuery
+    from realtime.vision import VisionModel
+
+    images_dir = tempfile.mkdtemp(prefix="search_benchmark_")
+    if args.catalog:
+        catalog = pd.read_csv(args.catalog).fillna("")
+        catalog["on_sale"] = catalog["on_sale"].apply({0: "Regular Price", 1: "On Sale"}.get)
+        images_dir = args.images_dir
+    else:
+        catalog = create_catalog(args.products, images_dir)
+    use_local_search(catalog, images_dir, FakeEmbedder(latency=args.embed_latency), args.index_latency)
+
+    completion = SyntheticCompletion(args.fixtures, record=args.record, latency=args.llm_latency)
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    if not args.llm_cache:
+        completion_cache.max_entries = 0
+
+    latencies = []
+
+    async def run_session(session_index: int):
+        init_http_context()
+        vision_model = VisionModel()
+        vision_model.client = completion
+        cl.user_session.set("vision_model", vision_model)
+        for repeat in range(args.repeat):
+            for query in queries[session_index::args.sessions] if args.sessions > 1 else queries:
+                start = time.perf_counter()
+                await SearchByTextQuery.handler(query=query)
+                latencies.append(("text", time.perf_counter() - start))
+                if args.image_searches:
+                    start = time.perf_counter()
+                    await SearchByImageQuery.handler(description_of_previous_recommendation="the first one")
+                    latencies.append(("image", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(i) for i in range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    print(f"Catalog:           {len(catalog)} products")
+    print(f"Searches:          {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.1f}/s)")
+    for kind in ("text", "image"):
+        values = [latency for search_kind, latency in latencies if search_kind == kind]
+        if values:
+            print(
+                f"{kind.capitalize() + ' search:':<19}p50 {percentile(values, 50) * 1000:.1f}ms / "
+                f"p95 {percentile(values, 95) * 1000:.1f}ms"
+            )
+    print(f"LLM responses:     {completion.stats}")
+    print(f"LLM cache hits:    {completion_cache.hit_ratio():.1%}")
+
+    durations, _ = load_durations([trace_file])
+    print(f"\n{'stage':<28}{'count':>8}{'total ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        print(
+            f"{name:<28}{len(values):>8}{sum(values):>10.1f}"
+            f"{percentile(values, 50):>10.2f}{percentile(values, 95):>10.2f}"
+        )
+
+    if args.allocations:
+        init_http_context()
+        vision_model = VisionModel()
+        vision_model.client = completion
+        cl.user_session.set("vision_model", vision_model)
+        await SearchByTextQuery.handler(query=queries[0])
+        tracemalloc.start()
+        peaks, blocks = [], []
+        for query in queries:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            await SearchByTextQuery.handler(query=query)
+            after = tracemalloc.take_snapshot()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            blocks.append(sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0))
+        tracemalloc.stop()
+        print(f"\nPeak traced memory per text search:    p50 {percentile(peaks, 50) / 1024:.0f} KiB")
+        print(f"Blocks still allocated after a search: p50 {percentile(blocks, 50):.0f}")
+
+    if args.record:
+        completion.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000, help="Size of the synthetic catalog")
+    parser.add_argument("--catalog", help="CSV catalog to index instead, e.g. data/product_catalog.csv")
+    parser.add_argument("--images-dir", default="data/product_catalog_images", help="Images of the --catalog")
+    parser.add_argument("--queries", help="File of text queries, one per line")
+    parser.add_argument("--sessions", type=int, default=1, help="Number of concurrent user sessions")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times each session runs its queries")
+    parser.add_argument("--image-searches", action="store_true", help="Follow each text search with an image search")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Simulated embedding latency in seconds")
+    parser.add_argument("--index-latency", type=float, default=0.0, help="Simulated index query latency in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated LLM latency in seconds")
+    parser.add_argument("--no-llm-cache", dest="llm_cache", action="store_false",
+                        help="Disable the completion cache, so repeated queries call the (synthetic) LLM again")
+    parser.add_argument("--fixtures", help="Recorded LLM responses to replay instead of synthesizing them")
+    parser.add_argument("--record", action="store_true",
+                        help="Record missing LLM responses into --fixtures with the real model")
+    parser.add_argument("--allocations", action="store_true", help="Measure allocations per search with tracemalloc")
+    args = parser.parse_args()
+    if args.record and not args.fixtures:
+        parser.error("--record needs --fixtures")
+
+    # Must be set before the realtime modules are imported
+    with tempfile.NamedTemporaryFile(prefix="search_benchmark_", suffix=".jsonl", delete=False) as f:
+        trace_file = f.name
+    os.environ["REALTIME_TRACE_FILE"] = trace_file
+    os.environ["TRY_ON_WARMUP_TOP_N"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    asyncio.run(run_benchmark(args, trace_file))
@@ -0,0 +1,166 @@
+"""
+Benchmark concurrent virtual try-ons through VirtualTryOn.handler and the try-on cache against the local Segmind stub.
+
+Reports p50/p95 latency, cache hit ratio and bytes transferred to and from the try-on API:
+    python scripts/benchmark_try_on.py --sessions 8 --requests-per-session 4 --products 6 --latency 2
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+import uvicorn
+from PIL import Image
+
+from segmind_stub import DEFAULT_PORT, create_app
+from trace_summary import percentile
+
+
+class InMemoryRedis:
+    """In-process replacement for the few redis client methods RedisCache uses, for laptops without Redis."""
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.store.pop(key, None)
+
+    def random_key(self):
+        return None
+
+    def pipeline(self):
+        return InMemoryPipeline(self)
+
+
+class InMemoryPipeline:
+    def __init__(self, client: InMemoryRedis):
+        self.client = client
+        self.commands = []
+
+    def set(self, *args, **kwargs):
+        self.commands.append((self.client.set, args, kwargs))
+
+    def delete(self, *args):
+        self.commands.append((self.client.delete, args, {}))
+
+    def execute(self):
+        for command, args, kwargs in self.commands:
+            command(*args, **kwargs)
+        self.commands = []
+
+
+def start_stub(port: int, latency: float, jitter: float, failure_rate: float) -> uvicorn.Server:
+    config = uvicorn.Config(
+        create_app(latency=latency, jitter=jitter, failure_rate=failure_rate),
+        port=port,
+        log_level="warning",
+    )
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def create_products(num_products: int, images_dir: str) -> list[dict]:
+    """
+    Create fake product matches with distinct solid-colour cloth images.
+    """
+    rng = random.Random(0)
+    products = []
+    for i in range(num_products):
+        image_path = os.path.join(images_dir, f"0{100000000 + i}.jpg")
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        Image.new("RGB", (400, 600), colour).save(image_path, "JPEG")
+        products.append({
+            "metadata": {
+                "article_id": str(100000000 + i),
+                "prod_name": f"Benchmark Shirt {i}",
+                "colour_group_name": f"Colour {i}",
+                "product_group_name": "Garment Upper body",
+                "image": image_path,
+            }
+        })
+    return products
+
+
+async def run_benchmark(args: argparse.Namespace, stub_url: str) -> None:
+    from chainlit.context import init_http_context
+
+    from realtime import virtual_try_on
+    from realtime.product_search.product_table import set_latest_products
+    from realtime.virtual_try_on import VirtualTryOn, try_on_executor
+
+    if args.cache == "memory":
+        virtual_try_on.redis_cache.redis_client = InMemoryRedis()
+
+    images_dir = tempfile.mkdtemp(prefix="try_on_benchmark_")
+    products = create_products(args.products, images_dir)
+    latencies = []
+
+    async def run_session(session_index: int):
+        init_http_context()
+        set_latest_products(products)
+        rng = random.Random(session_index)
+        for _ in range(args.requests_per_session):
+            index = rng.randrange(len(products))
+            start = time.perf_counter()
+            # Positions are resolved locally, without an LLM call
+            await VirtualTryOn.handler(
+                description_of_previous_recommendation=f"number {index + 1}", category="Upper body"
+            )
+            latencies.append(time.perf_counter() - start)
+
+    requests.post(f"{stub_url}/stats/reset")
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(i) for i in range(args.sessions)))
+    elapsed = time.perf_counter() - start
+    stub_stats = requests.get(f"{stub_url}/stats").json()
+
+    stats = try_on_executor.stats
+    served_without_api = stats["cache_hits"] + stats["deduplicated"]
+    print(f"Try-ons:              {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.2f}/s)")
+    print(f"Latency p50 / p95:    {percentile(latencies, 50):.3f}s / {percentile(latencies, 95):.3f}s")
+    print(f"Cache hits:           {stats['cache_hits']}")
+    print(f"Deduplicated:         {stats['deduplicated']}")
+    print(f"Hit ratio:            {served_without_api / max(1, stats['requests']):.1%}")
+    print(f"API calls / retries:  {stats['api_calls']} / {stats['retries']} ({stats['failures']} failed)")
+    print(f"Max concurrent calls: {stub_stats['max_in_flight']}")
+    print(f"Bytes sent to API:    {stub_stats['bytes_received']:,}")
+    print(f"Bytes received:       {stub_stats['bytes_sent']:,}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=8, help="Number of concurrent user sessions")
+    parser.add_argument("--requests-per-session", type=int, default=4)
+    parser.add_argument("--products", type=int, default=6, help="Number of distinct products tried on")
+    parser.add_argument("--cache", choices=["memory", "redis"], default="memory",
+                        help="Back the try-on cache with an in-process store or the Redis at REDIS_HOST/REDIS_PORT")
+    parser.add_argument("--stub-url", help="URL of an already running stub, instead of starting one")
+    parser.add_argument("--stub-port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=2.0, help="Mean stub latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Maximum stub latency deviation in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub_url = args.stub_url
+    if not stub_url:
+        start_stub(args.stub_port, args.latency, args.jitter, args.failure_rate)
+        stub_url = f"http://localhost:{args.stub_port}"
+    # Must be set before the try-on module is imported
+    os.environ["SEGMIND_API_BASE"] = f"{stub_url}/v1/virtual-try-on"
+    os.environ.setdefault("SEGMIND_API_KEY", "benchmark")
+
+    asyncio.run(run_benchmark(args, stub_url))
@@ -0,0 +1,45 @@
+"""
+Embed the image of every catalog product and store it in the image namespace of the product index, so that
+SearchByImageQuery looks the vector of the product up by article_id instead of embedding its image at query time.
+Products already embedded are skipped, so the script can be rerun after an interruption or to embed new products.
+
+    python scripts/embed_product_images.py --requests-per-minute 24 --concurrency 4
+    python scripts/embed_product_images.py --limit 100
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog", default="data/product_catalog.csv", help="Product catalog CSV")
+    parser.add_argument("--images-dir", default="data/product_catalog_images", help="Images of the --catalog")
+    parser.add_argument("--limit", type=int, help="Embed the images of the first LIMIT products only")
+    parser.add_argument("--batch-size", type=int, default=96, help="Number of vectors upserted at once")
+    parser.add_argument("--concurrency", type=int, help="Images embedded concurrently, IMAGE_EMBED_CONCURRENCY by default")
+    parser.add_argument("--requests-per-minute", type=float,
+                        help="Maximum embedding requests per minute, IMAGE_EMBED_REQUESTS_PER_MINUTE by default")
+    parser.add_argument("--overwrite", action="store_true", help="Embed the products already embedded again")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from realtime.product_search.base import IMAGE_EMBED_CONCURRENCY, IMAGE_EMBED_REQUESTS_PER_MINUTE, ProductSearch
+
+    products_df = pd.read_csv(args.catalog, usecols=["article_id"]).head(args.limit)
+    product_search = ProductSearch()
+    start = time.perf_counter()
+    embedded = product_search.add_image_embeddings(
+        products_df,
+        args.images_dir,
+        batch_size=args.batch_size,
+        max_workers=args.concurrency or IMAGE_EMBED_CONCURRENCY,
+        requests_per_minute=(
+            IMAGE_EMBED_REQUESTS_PER_MINUTE if args.requests_per_minute is None else args.requests_per_minute
+        ),
+        overwrite=args.overwrite
+    )
+    print(f"Embedded {embedded} of {len(products_df)} product images in {time.perf_counter() - start:.0f}s")
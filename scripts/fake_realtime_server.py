@@ -0,0 +1,279 @@
+"""
+Local stand-in for the OpenAI realtime API, for load tests and offline development. It acknowledges the session,
+detects the end of the user's speech after a fixed duration of input audio, and answers every user turn with the
+scenario's tool calls, then with spoken audio streamed in real time. Scenario files in scripts/realtime_scenarios
+change the turns, the sizes of the deltas and the rate of the audio.
+
+    python scripts/fake_realtime_server.py --port 8765 --scenario scripts/realtime_scenarios/parallel_tools.json
+    REALTIME_URL=ws://localhost:8765 chainlit run app.py
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+from contextlib import suppress
+from itertools import count
+
+import websockets
+
+
+SCENARIOS_DIR = os.path.join(os.path.dirname(__file__), "realtime_scenarios")
+SAMPLE_RATE = 24000
+DEFAULT_SCENARIO = {
+    # Input audio after which the user's turn ends
+    "speech_ms": 1500,
+    # Transcription of the user's audio, if any
+    "input_transcript": None,
+    # Tool calls made in response to every user turn, before answering
+    "tool_calls": [{"name": "search_by_text_query", "arguments": {"query": "red summer dress"}}],
+    # Size of the function call argument deltas, all at once if 0
+    "arguments_delta_chars": 0,
+    "response_transcript": "Here are a few red summer dresses you might like!",
+    # Size of the transcript deltas, all at once if 0
+    "transcript_delta_chars": 0,
+    "response_audio_ms": 2000,
+    "audio_chunk_ms": 50,
+    # Speed of the audio relative to real time, as fast as possible if 0
+    "audio_speed": 1.0,
+}
+
+
+def pcm16_bytes(ms: float) -> int:
+    return int(SAMPLE_RATE * ms / 1000) * 2
+
+
+class FakeRealtimeServer:
+    def __init__(self, host: str = "localhost", port: int = 0, scenario: dict = None):
+        """
+        Websocket server speaking the subset of the realtime protocol used by RealtimeClient.
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, any free port if 0
+            scenario: Overrides of DEFAULT_SCENARIO
+        """
+        self.host = host
+        self.port = port
+        self.scenario = {**DEFAULT_SCENARIO, **(scenario or {})}
+        self._server = None
+        self._ids = count()
+        self.stats = {
+            "connections": 0, "turns": 0, "responses": 0, "tool_calls": 0, "tool_outputs": 0, "events": 0,
+            "audio_bytes": 0,
+        }
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._server = await websockets.serve(self._handle_connection, self.host, self.port, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids)}"
+
+    async def _handle_connection(self, websocket) -> None:
+        self.stats["connections"] += 1
+        connection = _Connection(self, websocket)
+        await connection.send("session.created", session={"id": self._id("sess")})
+        try:
+            async for message in websocket:
+                await connection.handle(json.loads(message))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            connection.close()
+
+
+class _Connection:
+    def __init__(self, server: FakeRealtimeServer, websocket):
+        self.server = server
+        self.scenario = server.scenario
+        self.websocket = websocket
+        self.audio_bytes = 0
+        self.speech_start_ms = None
+        self.speech_item_id = None
+        self.awaiting_tool_outputs = 0
+        self.answer_next = False
+        self.response_task = None
+
+    def close(self) -> None:
+        if self.response_task:
+            self.response_task.cancel()
+
+    async def send(self, event_type: str, **data) -> None:
+        self.server.stats["events"] += 1
+        await self.websocket.send(json.dumps({"event_id": self.server._id("event"), "type": event_type, **data}))
+
+    async def handle(self, event: dict) -> None:
+        if event["type"] == "session.update":
+            await self.send("session.updated", session=event["session"])
+        elif event["type"] == "input_audio_buffer.append":
+            await self._append_audio(len(base64.b64decode(event["audio"])))
+        elif event["type"] == "conversation.item.create":
+            item = {"id": self.server._id("item"), **event["item"]}
+            await self.send("conversation.item.created", previous_item_id=None, item=item)
+            if item["type"] == "function_call_output":
+                self.server.stats["tool_outputs"] += 1
+                self.awaiting_tool_outputs -= 1
+                self.answer_next = self.awaiting_tool_outputs == 0
+            else:
+                self.answer_next = False
+        elif event["type"] == "response.create":
+            self._respond(answer=self.answer_next)
+        elif event["type"] == "response.cancel":
+            self._cancel_response()
+
+    async def _append_audio(self, num_bytes: int) -> None:
+        audio_ms = self.audio_bytes / pcm16_bytes(1)
+        self.audio_bytes += num_bytes
+        if self.speech_start_ms is None:
+            self.speech_start_ms = audio_ms
+            self.speech_item_id = item_id = self.server._id("item")
+            # As with server VAD, speaking interrupts the response in progress
+            self._cancel_response()
+            await self.send("input_audio_buffer.speech_started", audio_start_ms=int(audio_ms), item_id=item_id)
+        end_ms = self.audio_bytes / pcm16_bytes(1)
+        if end_ms - self.speech_start_ms >= self.scenario["speech_ms"]:
+            self.server.stats["turns"] += 1
+            item_id = self.speech_item_id
+            await self.send("input_audio_buffer.speech_stopped", audio_end_ms=int(end_ms), item_id=item_id)
+            await self.send("input_audio_buffer.committed", previous_item_id=None, item_id=item_id)
+            await self.send("conversation.item.created", previous_item_id=None, item={
+                "id": item_id, "type": "message", "role": "user", "status": "completed",
+                "content": [{"type": "input_audio", "transcript": None}],
+            })
+            if self.scenario["input_transcript"] is not None:
+                await self.send(
+                    "conversation.item.input_audio_transcription.completed", item_id=item_id, content_index=0,
+                    transcript=self.scenario["input_transcript"],
+                )
+            self.speech_start_ms = None
+            self.answer_next = False
+            self._respond(answer=False)
+
+    def _cancel_response(self) -> None:
+        if self.response_task and not self.response_task.done():
+            self.response_task.cancel()
+
+    def _respond(self, answer: bool) -> None:
+        """
+        Start the response to the user's turn: its tool calls first, unless they were answered already.
+        """
+        self._cancel_response()
+        self.answer_next = False
+        tool_calls = [] if answer else self.scenario["tool_calls"]
+        self.response_task = asyncio.create_task(self._stream_response(tool_calls))
+
+    async def _stream_response(self, tool_calls: list[dict]) -> None:
+        self.server.stats["responses"] += 1
+        response_id = self.server._id("resp")
+        await self.send("response.created", response={"id": response_id, "status": "in_progress", "output": []})
+        output = []
+        try:
+            if tool_calls:
+                self.awaiting_tool_outputs = len(tool_calls)
+                for tool_call in tool_calls:
+                    output.append(await self._stream_tool_call(response_id, tool_call))
+            else:
+                output.append(await self._stream_audio(response_id))
+        except asyncio.CancelledError:
+            with suppress(websockets.ConnectionClosed):
+                await self.send("response.done", response={"id": response_id, "status": "cancelled", "output": output})
+            raise
+        await self.send("response.done", response={"id": response_id, "status": "completed", "output": output})
+
+    async def _stream_tool_call(self, response_id: str, tool_call: dict) -> dict:
+        self.server.stats["tool_calls"] += 1
+        item = {
+            "id": self.server._id("item"), "type": "function_call", "status": "in_progress",
+            "name": tool_call["name"], "call_id": self.server._id("call"), "arguments": "",
+        }
+        await self.send("response.output_item.added", response_id=response_id, output_index=0, item=item)
+        await self.send("conversation.item.created", previous_item_id=None, item=item)
+        arguments = json.dumps(tool_call["arguments"])
+        for delta in split(arguments, self.scenario["arguments_delta_chars"]):
+            await self.send(
+                "response.function_call_arguments.delta", response_id=response_id, item_id=item["id"],
+                output_index=0, call_id=item["call_id"], delta=delta,
+            )
+        item = {**item, "status": "completed", "arguments": arguments}
+        await self.send("response.output_item.done", response_id=response_id, output_index=0, item=item)
+        return item
+
+    async def _stream_audio(self, response_id: str) -> dict:
+        item = {"id": self.server._id("item"), "type": "message", "role": "assistant", "status": "in_progress", "content": []}
+        await self.send("response.output_item.added", response_id=response_id, output_index=0, item=item)
+        await self.send("conversation.item.created", previous_item_id=None, item=item)
+        await self.send(
+            "response.content_part.added", response_id=response_id, item_id=item["id"], output_index=0,
+            content_index=0, part={"type": "audio", "transcript": ""},
+        )
+        # As from the real API, transcript deltas are interleaved with the audio they were spoken in
+        transcript = split(self.scenario["response_transcript"], self.scenario["transcript_delta_chars"])
+        chunk_ms = self.scenario["audio_chunk_ms"]
+        num_chunks = int(self.scenario["response_audio_ms"] // chunk_ms)
+        chunk = base64.b64encode(bytes(pcm16_bytes(chunk_ms))).decode()
+        chunk_seconds = chunk_ms / 1000 / self.scenario["audio_speed"] if self.scenario["audio_speed"] else 0.0
+        start = time.perf_counter()
+        for i in range(max(num_chunks, len(transcript))):
+            if chunk_seconds:
+                await asyncio.sleep(max(0.0, start + i * chunk_seconds - time.perf_counter()))
+            if i < len(transcript):
+                await self.send(
+                    "response.audio_transcript.delta", response_id=response_id, item_id=item["id"], output_index=0,
+                    content_index=0, delta=transcript[i],
+                )
+            if i < num_chunks:
+                self.server.stats["audio_bytes"] += pcm16_bytes(chunk_ms)
+                await self.send(
+                    "response.audio.delta", response_id=response_id, item_id=item["id"], output_index=0,
+                    content_index=0, delta=chunk,
+                )
+        item = {
+            **item, "status": "completed",
+            "content": [{"type": "audio", "transcript": self.scenario["response_transcript"]}],
+        }
+        await self.send("response.output_item.done", response_id=response_id, output_index=0, item=item)
+        return item
+
+
+def split(text: str, size: int) -> list[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] if size else [text]
+
+
+def load_scenario(path: str) -> dict:
+    """
+    Read a scenario file, a JSON object overriding some of DEFAULT_SCENARIO.
+    """
+    with open(path) as f:
+        scenario = json.load(f)
+    unknown = set(scenario) - set(DEFAULT_SCENARIO) - {"description"}
+    if unknown:
+        raise ValueError(f"Unknown scenario settings in {path}: {sorted(unknown)}")
+    return scenario
+
+
+async def serve(host: str, port: int, scenario: dict) -> None:
+    server = FakeRealtimeServer(host, port, scenario)
+    await server.start()
+    print(f"Fake realtime server listening on {server.url}")
+    await asyncio.Future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scenario", help="Scenario file, e.g. scripts/realtime_scenarios/fast_audio.json")
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, load_scenario(args.scenario) if args.scenario else None))
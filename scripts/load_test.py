@@ -0,0 +1,253 @@
+"""
+Load test of app.py with concurrent sessions. Each session goes through on_chat_start and on_audio_start, then
+streams microphone audio in real time with on_audio_chunk (and with --text-every, sends some turns with on_message),
+against a local fake realtime server whose turns call the product search tool before answering with audio. Search
+runs on the local stand-ins of benchmark_search.py.
+
+Reports the event loop lag, the jitter of the audio sent to the browsers, memory per session and tool latency:
+    python scripts/load_test.py --sessions 50 --turns 3 --memory
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmark_search import FakeEmbedder, SyntheticCompletion, create_catalog, use_local_search
+from fake_realtime_server import DEFAULT_SCENARIO, FakeRealtimeServer, load_scenario, pcm16_bytes
+from trace_summary import load_durations, percentile
+
+
+class SessionRecorder:
+    def __init__(self):
+        """
+        What a session's browser received: the arrival time, duration and track of every audio chunk, and the
+        summary of the session's audio output queue.
+        """
+        self.audio_chunks = []
+        self.interrupts = 0
+        self.turn_seconds = []
+        self.audio_output = {}
+
+
+def recording_emitter(session, recorder: SessionRecorder):
+    from chainlit.emitter import BaseChainlitEmitter
+    from chainlit.config import config
+
+    bytes_per_second = pcm16_bytes(1000)
+
+    class RecordingEmitter(BaseChainlitEmitter):
+        async def send_audio_chunk(self, chunk):
+            recorder.audio_chunks.append((time.perf_counter(), len(chunk["data"]) / bytes_per_second, chunk["track"]))
+
+        async def send_audio_interrupt(self):
+            recorder.interrupts += 1
+
+    assert config.features.audio.sample_rate == 24000, "The fake realtime server streams 24kHz audio"
+    return RecordingEmitter(session)
+
+
+def audio_delivery(recorders: list[SessionRecorder], buffer_ms: float) -> tuple[list[float], int, int]:
+    """
+    Gaps between consecutive chunks of a track minus the duration of the earlier chunk, in ms, and the number of
+    chunks arriving after the audio before them would have finished playing, i.e. when the browser ran dry, if
+    playback starts buffer_ms after the first chunk of a track.
+    """
+    jitter, late, total = [], 0, 0
+    for recorder in recorders:
+        previous_track, play_until = None, 0.0
+        for (arrival, duration, track), previous in zip(recorder.audio_chunks, [None] + recorder.audio_chunks):
+            total += 1
+            if track != previous_track:
+                previous_track, play_until = track, arrival + buffer_ms / 1000 + duration
+                continue
+            jitter.append((arrival - previous[0] - previous[1]) * 1000)
+            if arrival > play_until:
+                late += 1
+            play_until = max(play_until, arrival) + duration
+    return jitter, late, total
+
+
+async def monitor_loop_lag(samples: list[float], interval: float = 0.01) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def run_session(
+    index: int,
+    args: argparse.Namespace,
+    speech_ms: float,
+    completion: SyntheticCompletion,
+    recorder: SessionRecorder,
+    ready: asyncio.Semaphore,
+    finish: asyncio.Event,
+) -> None:
+    import chainlit as cl
+    from chainlit.context import init_http_context
+    from chainlit.types import InputAudioChunk
+
+    import app
+
+    await asyncio.sleep(args.ramp_seconds * index / args.sessions)
+    context = init_http_context()
+    context.emitter = recording_emitter(context.session, recorder)
+    try:
+        await app.start()
+        cl.user_session.get("vision_model").client = completion
+        if not await app.on_audio_start():
+            raise Exception("Could not connect to the fake realtime server")
+
+        turn_done = asyncio.Event()
+
+        def on_response_done(event):
+            if any(item["type"] == "message" for item in event["response"]["output"]):
+                turn_done.set()
+
+        cl.user_session.get("openai_realtime").realtime.on("server.response.done", on_response_done)
+
+        chunk = bytes(pcm16_bytes(args.chunk_ms))
+        for turn in range(args.turns):
+            await asyncio.sleep(random.uniform(0, args.think_seconds))
+            turn_done.clear()
+            start = time.perf_counter()
+            if args.text_every and turn % args.text_every == args.text_every - 1:
+                await app.on_message(cl.Message(content="Show me something similar in blue"))
+            else:
+                # Stream just enough speech for the server to end the turn, in real time like a microphone
+                for i in range(math.ceil(speech_ms / args.chunk_ms)):
+                    await asyncio.sleep(max(0.0, start + i * args.chunk_ms / 1000 - time.perf_counter()))
+                    await app.on_audio_chunk(InputAudioChunk(
+                        isStart=i == 0, mimeType="pcm16", elapsedTime=i * args.chunk_ms, data=chunk
+                    ))
+            await asyncio.wait_for(turn_done.wait(), args.turn_timeout)
+            recorder.turn_seconds.append(time.perf_counter() - start)
+    finally:
+        ready.release()
+        # Sessions stay open until all are done, so memory is measured with every session alive
+        await finish.wait()
+        audio_output = cl.user_session.get("audio_output")
+        if audio_output:
+            recorder.audio_output = audio_output.summary()
+        await app.on_chat_end()
+
+
+async def run_load_test(args: argparse.Namespace, trace_file: str) -> None:
+    scenario = load_scenario(args.scenario) if args.scenario else {}
+    server = None
+    if not args.server_url:
+        server = FakeRealtimeServer(port=0, scenario=scenario)
+        await server.start()
+    # Must be set before the realtime modules are imported
+    os.environ["REALTIME_URL"] = args.server_url or server.url
+
+    from realtime import services
+
+    images_dir = tempfile.mkdtemp(prefix="load_test_")
+    use_local_search(create_catalog(args.products, images_dir), images_dir, FakeEmbedder(), 0.0)
+    completion = SyntheticCompletion(args.fixtures, latency=args.llm_latency)
+    # Import litellm and the app before measuring, as a running server would have
+    await services.warmup()
+    import app  # noqa: F401
+
+    lag = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag))
+    if args.memory:
+        tracemalloc.start()
+    baseline_memory = tracemalloc.get_traced_memory()[0] if args.memory else 0
+
+    recorders = [SessionRecorder() for _ in range(args.sessions)]
+    ready = asyncio.Semaphore(0)
+    finish = asyncio.Event()
+    start = time.perf_counter()
+    sessions = [
+        asyncio.create_task(run_session(i, args, {**DEFAULT_SCENARIO, **scenario}["speech_ms"], completion, recorder, ready, finish))
+        for i, recorder in enumerate(recorders)
+    ]
+    for _ in sessions:
+        await ready.acquire()
+    elapsed = time.perf_counter() - start
+    session_memory = (tracemalloc.get_traced_memory()[0] - baseline_memory) / args.sessions if args.memory else None
+    finish.set()
+    results = await asyncio.gather(*sessions, return_exceptions=True)
+    monitor.cancel()
+    tracemalloc.stop()
+    if server:
+        await server.close()
+
+    failures = [result for result in results if isinstance(result, BaseException)]
+    turns = [seconds for recorder in recorders for seconds in recorder.turn_seconds]
+    jitter, late, total_chunks = audio_delivery(recorders, args.playback_buffer_ms)
+    print(f"Sessions:          {args.sessions} ({len(failures)} failed) in {elapsed:.1f}s")
+    for failure in failures[:3]:
+        print(f"  {type(failure).__name__}: {failure}")
+    if server:
+        print(f"Server:            {server.stats}")
+    if turns:
+        print(f"Turns:             {len(turns)}, p50 {percentile(turns, 50):.2f}s / p95 {percentile(turns, 95):.2f}s")
+    print(
+        f"Event loop lag:    p50 {percentile(lag, 50):.1f}ms / p95 {percentile(lag, 95):.1f}ms / "
+        f"max {max(lag):.1f}ms"
+    )
+    if jitter:
+        print(
+            f"Audio jitter:      p50 {percentile(jitter, 50):.1f}ms / p95 {percentile(jitter, 95):.1f}ms / "
+            f"max {max(jitter):.1f}ms, {late} of {total_chunks} chunks late"
+        )
+    queue_depths = [recorder.audio_output["max_depth_ms"] for recorder in recorders if recorder.audio_output]
+    if queue_depths:
+        dropped_ms = sum(recorder.audio_output["dropped_ms"] for recorder in recorders if recorder.audio_output)
+        print(
+            f"Audio queue depth: p50 {percentile(queue_depths, 50):.0f}ms / max {max(queue_depths):.0f}ms per session, "
+            f"{dropped_ms}ms dropped"
+        )
+    if session_memory is not None:
+        print(f"Memory:            {session_memory / 1024:.0f} KiB per session")
+
+    durations, errors = load_durations([trace_file])
+    print(f"\n{'stage':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'errors':>8}")
+    for name in sorted(durations, key=lambda name: (not name.startswith(("tool.", "realtime.")), name)):
+        values = durations[name]
+        print(
+            f"{name:<28}{len(values):>8}{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}"
+            f"{max(values):>10.1f}{errors[name]:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="Number of concurrent sessions")
+    parser.add_argument("--server-url", help="Fake realtime server started separately, so it does not share the "
+                                             "event loop of the sessions, e.g. ws://localhost:8765")
+    parser.add_argument("--scenario", help="Scenario of the fake realtime server, also needed with --server-url")
+    parser.add_argument("--turns", type=int, default=3, help="Number of turns per session")
+    parser.add_argument("--text-every", type=int, default=0, help="Send every n-th turn as a text message")
+    parser.add_argument("--ramp-seconds", type=float, default=2.0, help="Time over which sessions are started")
+    parser.add_argument("--think-seconds", type=float, default=1.0, help="Maximum pause before each turn")
+    parser.add_argument("--chunk-ms", type=int, default=100, help="Duration of the microphone audio chunks")
+    parser.add_argument("--playback-buffer-ms", type=float, default=100.0,
+                        help="Audio the browser buffers before playing, for counting late audio chunks")
+    parser.add_argument("--turn-timeout", type=float, default=60.0, help="Seconds after which a turn fails")
+    parser.add_argument("--products", type=int, default=2000, help="Size of the synthetic catalog")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Simulated LLM latency in seconds")
+    parser.add_argument("--fixtures", help="Recorded LLM responses to replay instead of synthesizing them")
+    parser.add_argument("--memory", action="store_true",
+                        help="Measure memory per session with tracemalloc, which slows everything down")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(prefix="load_test_", suffix=".jsonl", delete=False) as f:
+        trace_file = f.name
+    os.environ["REALTIME_TRACE_FILE"] = trace_file
+    os.environ["TRY_ON_WARMUP_TOP_N"] = "0"
+    os.environ.setdefault("OPENAI_API_KEY", "load-test")
+    # app.py loads its static files relative to the repository root
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(root)
+    sys.path.insert(0, root)
+
+    asyncio.run(run_load_test(args, trace_file))
@@ -0,0 +1,111 @@
+"""
+Profile RealtimeClient's event processing against the fake realtime server: throughput in events per second, memory
+held by the conversation and, with --cprofile, the functions the time is spent in. Tools called by the scenario are
+stubbed, so only the client is measured.
+
+    python scripts/profile_realtime_client.py scripts/realtime_scenarios/fast_audio.json --turns 5 --memory
+    python scripts/profile_realtime_client.py scripts/realtime_scenarios/parallel_tools.json --cprofile 25
+
+The server runs in the same process unless --server-url is given, started with the same scenario:
+    python scripts/fake_realtime_server.py --port 8765 --scenario scripts/realtime_scenarios/fast_audio.json
+"""
+import argparse
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+from fake_realtime_server import DEFAULT_SCENARIO, FakeRealtimeServer, load_scenario, pcm16_bytes
+
+
+async def run_profile(args: argparse.Namespace) -> None:
+    from realtime import RealtimeClient
+
+    scenario = {**DEFAULT_SCENARIO, **(load_scenario(args.scenario) if args.scenario else {})}
+    server = None
+    if not args.server_url:
+        server = FakeRealtimeServer(port=0, scenario=scenario)
+        await server.start()
+
+    client = RealtimeClient(url=args.server_url or server.url, api_key="profile", retain_audio=args.retain_audio)
+
+    async def stub_tool(**kwargs):
+        return {"ok": True}
+
+    tool_names = {tool_call["name"] for tool_call in scenario["tool_calls"]}
+    await client.add_tools([
+        ({"name": name, "description": "", "parameters": {"type": "object", "properties": {}}}, stub_tool)
+        for name in tool_names
+    ])
+
+    events = 0
+
+    def count_event(event):
+        nonlocal events
+        events += 1
+
+    turn_done = asyncio.Event()
+
+    def on_response_done(event):
+        if any(item["type"] == "message" for item in event["response"]["output"]):
+            turn_done.set()
+
+    client.realtime.on("server.*", count_event)
+    client.realtime.on("server.response.done", on_response_done)
+    await client.connect()
+    await client.wait_for_session_created()
+
+    if args.memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler:
+        profiler.enable()
+    speech = bytes(pcm16_bytes(scenario["speech_ms"] + 10))
+    events = 0
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        turn_done.clear()
+        if args.audio:
+            await client.append_input_audio(speech)
+        else:
+            await client.send_user_message_content([{"type": "input_text", "text": "Show me a red summer dress"}])
+        await turn_done.wait()
+    elapsed = time.perf_counter() - start
+    if profiler:
+        profiler.disable()
+    if args.memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    audio_seconds = args.turns * scenario["response_audio_ms"] / 1000
+    print(f"Turns:        {args.turns} in {elapsed:.2f}s")
+    print(f"Events:       {events} ({events / elapsed:,.0f}/s)")
+    print(f"Audio:        {audio_seconds:.0f}s received at {audio_seconds / elapsed:.1f}x real time")
+    print(f"Conversation: {len(client.conversation.get_items())} items")
+    if args.memory:
+        print(f"Memory:       {current / 1024:.0f} KiB held after the turns, {peak / 1024:.0f} KiB peak")
+
+    await client.disconnect()
+    if server:
+        await server.close()
+    if profiler:
+        pstats.Stats(profiler).sort_stats(args.sort).print_stats(args.cprofile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", nargs="?", help="Scenario file of the fake realtime server")
+    parser.add_argument("--server-url", help="Fake realtime server started separately, e.g. ws://localhost:8765")
+    parser.add_argument("--turns", type=int, default=3, help="Number of user turns")
+    parser.add_argument("--audio", action="store_true", help="Speak the turns instead of typing them")
+    parser.add_argument("--retain-audio", action="store_true", help="Keep the assistant's audio in the conversation")
+    parser.add_argument("--memory", action="store_true", help="Measure memory with tracemalloc")
+    parser.add_argument("--cprofile", type=int, metavar="N", help="Print the N most expensive functions")
+    parser.add_argument("--sort", default="tottime", help="cProfile sort order")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    asyncio.run(run_profile(args))
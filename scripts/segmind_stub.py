@@ -0,0 +1,104 @@
+"""
+Local stand-in for the Segmind virtual try-on API, for exercising the try-on path offline.
+
+Run it and point the app at it:
+    python scripts/segmind_stub.py --latency 8 --jitter 2 --failure-rate 0.05
+    SEGMIND_API_BASE=http://localhost:8082/v1/virtual-try-on chainlit run app.py
+"""
+import argparse
+import asyncio
+import base64
+import random
+from functools import lru_cache
+from io import BytesIO
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import Image, ImageOps
+
+
+DEFAULT_PORT = 8082
+OUTPUT_SIZE = (768, 1024)
+
+
+@lru_cache(maxsize=256)
+def render_try_on(model_image: str, cloth_image: str) -> bytes:
+    """
+    Render a deterministic fake try-on: the model image at the API's output size, tinted by the cloth image.
+    """
+    model = Image.open(BytesIO(base64.b64decode(model_image))).convert("RGB")
+    cloth = Image.open(BytesIO(base64.b64decode(cloth_image))).convert("RGB")
+    model = ImageOps.fit(model, OUTPUT_SIZE)
+    tint = cloth.resize((1, 1)).getpixel((0, 0))
+    result = Image.blend(model, Image.new("RGB", OUTPUT_SIZE, tint), 0.3)
+
+    buffer = BytesIO()
+    result.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def create_app(latency: float = 8.0, jitter: float = 2.0, failure_rate: float = 0.0, seed: int = 0) -> FastAPI:
+    """
+    Create the stub app.
+
+    Args:
+        latency: Mean generation latency in seconds
+        jitter: Maximum deviation from the mean latency in seconds
+        failure_rate: Fraction of requests that fail with a 503
+        seed: Seed of the latency and failure random generator
+    """
+    app = FastAPI()
+    rng = random.Random(seed)
+    stats = {"requests": 0, "failures": 0, "bytes_received": 0, "bytes_sent": 0, "in_flight": 0, "max_in_flight": 0}
+
+    @app.post("/v1/virtual-try-on")
+    async def virtual_try_on(request: Request):
+        body = await request.body()
+        data = await request.json()
+        stats["requests"] += 1
+        stats["bytes_received"] += len(body)
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(max(0.0, latency + rng.uniform(-jitter, jitter)))
+            if rng.random() < failure_rate:
+                stats["failures"] += 1
+                return JSONResponse(status_code=503, content={"error": "Simulated failure"})
+
+            content = await asyncio.to_thread(render_try_on, data["model_image"], data["cloth_image"])
+            if data.get("base64"):
+                response = JSONResponse(content={"image": base64.b64encode(content).decode("utf-8")})
+            else:
+                response = Response(content=content, media_type="image/jpeg")
+            stats["bytes_sent"] += len(response.body)
+            return response
+        finally:
+            stats["in_flight"] -= 1
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        for key in stats:
+            stats[key] = 0
+        return stats
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=8.0, help="Mean generation latency in seconds")
+    parser.add_argument("--jitter", type=float, default=2.0, help="Maximum latency deviation in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests failing with a 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate, seed=args.seed),
+        port=args.port,
+    )
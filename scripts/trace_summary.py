@@ -0,0 +1,61 @@
+"""
+Summarize the spans traced with REALTIME_TRACE_FILE: count, mean and p50/p95/p99 duration per stage.
+
+    REALTIME_TRACE_FILE=traces.jsonl chainlit run app.py
+    python scripts/trace_summary.py traces.jsonl --sort p95
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def load_durations(paths: list[str]) -> tuple[dict, dict]:
+    """
+    Read the span durations in milliseconds and the error counts, by span name.
+    """
+    durations, errors = defaultdict(list), defaultdict(int)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                span = json.loads(line)
+                durations[span["name"]].append(span["duration_ms"])
+                if span.get("error"):
+                    errors[span["name"]] += 1
+                if span["name"] == "realtime.turn" and "first_audio_ms" in span["attributes"]:
+                    durations["realtime.turn.first_audio"].append(span["attributes"]["first_audio_ms"])
+    return durations, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="JSONL trace files")
+    parser.add_argument("--sort", choices=["name", "count", "mean", "p50", "p95", "p99"], default="p95")
+    args = parser.parse_args()
+
+    durations, errors = load_durations(args.paths)
+    rows = []
+    for name, values in durations.items():
+        rows.append({
+            "name": name,
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "errors": errors[name],
+        })
+    rows.sort(key=lambda row: row[args.sort], reverse=args.sort != "name")
+
+    print(f"{'stage':<32}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for row in rows:
+        print(
+            f"{row['name']:<32}{row['count']:>8}{row['mean']:>10.1f}{row['p50']:>10.1f}"
+            f"{row['p95']:>10.1f}{row['p99']:>10.1f}{row['errors']:>8}"
+        )
@@ -0,0 +1,43 @@
+import unittest
+
+from realtime.product_search.references import resolve_product_reference
+
+
+def product(prod_name: str, colour: str, product_type: str) -> dict:
+    return {"metadata": {"prod_name": prod_name, "colour_group_name": colour, "product_type_name": product_type}}
+
+
+PRODUCTS = [
+    product("Linen shirt", "Blue", "Shirt"),
+    product("Wrap dress", "Red", "Dress"),
+    product("Slim jeans", "Dark Blue", "Trousers"),
+    product("Knit sweater", "Beige", "Sweater"),
+]
+
+
+class ResolveProductReferenceTest(unittest.TestCase):
+    def test_position(self):
+        self.assertEqual(resolve_product_reference("the second one", PRODUCTS), 1)
+        self.assertEqual(resolve_product_reference("number 3", PRODUCTS), 2)
+        self.assertEqual(resolve_product_reference("the last one", PRODUCTS), 3)
+        self.assertEqual(resolve_product_reference("the second to last", PRODUCTS), 2)
+
+    def test_colour(self):
+        self.assertEqual(resolve_product_reference("the blue shirt", PRODUCTS), 0)
+        self.assertEqual(resolve_product_reference("the blue one", PRODUCTS), 0)
+        self.assertEqual(resolve_product_reference("the red dress", PRODUCTS), 1)
+
+    def test_conflicting_position_and_colour(self):
+        self.assertIsNone(resolve_product_reference("the second one, the beige sweater", PRODUCTS))
+
+    def test_negation(self):
+        self.assertIsNone(resolve_product_reference("the one that isn't blue", PRODUCTS))
+        self.assertIsNone(resolve_product_reference("not the red dress", PRODUCTS))
+        self.assertIsNone(resolve_product_reference("anything other than the first", PRODUCTS))
+        self.assertIsNone(resolve_product_reference("the dress instead of the shirt", PRODUCTS))
+        self.assertIsNone(resolve_product_reference("every one except the jeans", PRODUCTS))
+        self.assertIsNone(resolve_product_reference("not that one", PRODUCTS[:1]))
+
+
+if __name__ == "__main__":
+    unittest.main()